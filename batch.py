@@ -6,7 +6,10 @@ Various utilities for ontology creation.
 
 import os, sys, time, glob, shutil, cProfile, pstats
 
-from path import filename_generator, ensure_path, create_file
+from path import filename_generator, ensure_path, create_file, file_exists
+from path import get_year_and_docid, set_dataset_compression
+from packed import create_packed_store
+from progress import read_progress_files, format_progress
 from git import get_git_commit
 
 
@@ -33,11 +36,12 @@ def read_pipeline_config(pipeline_file):
     return pipeline
 
 def pipeline_component_as_string(pipeline_slice):
-    """Returns a string representation of a pipeline slice."""
+    """Returns a string representation of a pipeline slice. Settings are
+    sorted so that the same pipeline always gives the same string."""
     elements = []
     for element in pipeline_slice:
         elements.append(element[0] + " " +
-                        " ".join(["%s=%s" % (k,v) for k,v in element[1].items()]))
+                        " ".join(["%s=%s" % (k,v) for k,v in sorted(element[1].items())]))
     return "\n".join(elements).strip() + "\n"
 
 def get_datasets(config, stage, input_name):
@@ -66,7 +70,8 @@ def show_datasets(rconfig, data_types, verbose=False):
 
 def show_processing_time(rconfig, data_types):
     """Show processing time for all available stages. An empty line with no time
-    typically means that processing is in progress."""
+    typically means that processing is in progress, use show_progress() to see
+    how far it got."""
     print "<Corpus on '%s'>" % rconfig.corpus
     for dataset_type in data_types:
         path = os.path.join(rconfig.corpus, 'data', dataset_type, '*', 'state')
@@ -81,6 +86,18 @@ def show_processing_time(rconfig, data_types):
                 else:
                     print '  ', dir[-8:-6]
 
+def show_progress(rconfig, data_types, finished=False):
+    """Show the progress of all running stages, as written by ProgressReporter
+    instances. Also show finished stages if finished is True."""
+    print "<Corpus on '%s'>" % rconfig.corpus
+    for dataset_type in data_types:
+        path = os.path.join(rconfig.corpus, 'data', dataset_type, '*', 'state')
+        for dir in sorted(glob.glob(path)):
+            for fields in read_progress_files(dir):
+                if fields.get('status') == 'finished' and not finished:
+                    continue
+                print '  ', dataset_type, dir[-8:-6], ' ', format_progress(fields)
+
 def parse_processing_time_line(line):
     try:
         (stage, count, time, git, seconds) = line.split("\t")
@@ -137,13 +154,13 @@ def _check_result(datasets):
 def check_file_availability(dataset, filelist):
     """Check whether all files in filelist are available in dataset. If not,
     print a warning and exit. This method allows for possibility that the file
-    was compressed."""
+    was compressed or that the dataset uses packed storage."""
     file_generator = filename_generator(dataset.path, filelist)
     total = 0
     not_in_dataset = 0
     for fname in file_generator:
         total += 1
-        if not os.path.exists(fname) and not os.path.exists(fname+'.gz'):
+        if not file_exists(fname):
             not_in_dataset += 1
     if not_in_dataset > 0:
         sys.exit("WARNING: %d/%d files in %s have not been processed yet\n         %s" %
@@ -172,6 +189,29 @@ def generate_doc_feats(s_phr_feats, doc_id, year):
         d_doc_feats[key] = features
     return d_doc_feats
 
+def generate_doc_feats_from_cache(cache, doc, doc_id=None, year=None):
+    """Like generate_doc_feats(), but take the phrase features of document
+    number doc from a FeatsCache instead of parsing a phr_feats file. By
+    default, the document identifier and the year are taken from the target
+    path of the document."""
+    if doc_id is None or year is None:
+        (target_year, target_doc_id) = get_year_and_docid(cache.docs[doc][0])
+        doc_id = target_doc_id if doc_id is None else doc_id
+        year = target_year if year is None else year
+    first, last = cache.document_range(doc)
+    d_term_feats = {}
+    for i in range(first, last):
+        d_term_feats.setdefault(cache.term[i], set()).update(cache.instance_features(i))
+    d_doc_feats = {}
+    for term_id, feat_ids in d_term_feats.items():
+        key = cache.terms[term_id]
+        value = [cache.features[f].replace(' ', '_') for f in feat_ids]
+        uid = year + "|" + doc_id + "|" + key.replace(" ", "_")
+        features = [key, uid]
+        features.extend(sorted(value))
+        d_doc_feats[key] = features
+    return d_doc_feats
+
 
 class RuntimeConfig(object):
 
@@ -305,9 +345,18 @@ class DataSet(object):
     def initialize_on_disk(self):
         """All that is guaranteed to exist is a directory like data/patents/en/d1_txt, but
         sub structures is not there. Create the substructure and initial versions of all
-        needed files in configuration and state directories."""
+        needed files in configuration and state directories. If the general
+        configuration has storage=packed, then the dataset will use packed
+        storage. If it has a compression setting, files in the dataset are
+        compressed with that codec, at compression_level if given."""
         for subdir in ('config', 'state', 'files'):
             ensure_path(os.path.join(self.path, subdir))
+        if self.global_config.storage == 'packed':
+            create_packed_store(self.path)
+        if self.global_config.compression is not None:
+            level = self.global_config.compression_level
+            set_dataset_compression(self.path, self.global_config.compression,
+                                    None if level is None else int(level))
         create_file(os.path.join(self.path, 'state', 'processed.txt'), "0\n")
         create_file(os.path.join(self.path, 'state', 'processing-history.txt'))
         trace, head = self.split_pipeline()
@@ -354,11 +403,16 @@ class DataSet(object):
         time_elapsed =  time.time() - t1
         processed = "%d\n" % self.files_processed
         create_file(os.path.join(self.path, 'state', 'processed.txt'), processed)
+        self.update_history(limit, time_elapsed)
+
+    def update_history(self, limit, time_elapsed):
+        """Append a line to state/processing-history.txt."""
         history_file = os.path.join(self.path, 'state', 'processing-history.txt')
         fh = open(history_file, 'a')
         fh.write("%s\t%d\t%s\t%s\t%s\n" % (self.stage_name, limit,
                                            time.strftime("%Y:%m:%d-%H:%M:%S"),
                                            get_git_commit(), time_elapsed))
+        fh.close()
 
     def update_processed_count(self, n):
         """Increment the count of files processed in the state directory."""
@@ -0,0 +1,146 @@
+"""
+
+Running consecutive pipeline stages in memory.
+
+Normally each stage of a pipeline writes a complete dataset to disk, which the
+next stage reads and parses again. A StageChain runs a number of consecutive
+stages from the pipeline of a RuntimeConfig on one document at a time, handing
+the output of each stage to the next stage in memory. Only stages that are
+marked with persist=True write a dataset, the last stage always does:
+
+   chain = StageChain(rconfig, [Stage('--tag', tag_document, 'd2_tag', persist=True),
+                                Stage('--chunk', chunk_document, 'd2_seg'),
+                                Stage('--features', feature_document, 'd3_phr_feats')],
+                      input_dataset)
+   chain.process(fspecs)
+
+A stage function takes the content of a document as a unicode string, the
+FileSpec of the document and the options of the stage from the pipeline
+configuration, and returns the content of its output document as a unicode
+string. It can return None to drop a document, in which case it is not handed
+to later stages. The input of the first stage is read from the files of
+input_dataset, or from the sources in the FileSpecs if there is no input
+dataset, in which case FileSpecs without a source are read from their target.
+
+Persisted datasets are created with DataSet.initialize_on_disk() if they do
+not exist yet, so their pipeline-head.txt and pipeline-trace.txt are the same
+as when the stages run one by one, the trace includes the stages that were
+fused. Files are written with open_output_file() and the state of the datasets
+is updated with DataSet.update_state() after each call to process().
+
+"""
+
+import os, sys, time
+
+from path import open_input_file, open_output_file, get_lines, ensure_path
+from batch import DataSet
+
+
+class Stage(object):
+
+    """A stage in a StageChain, with the name of the stage in the pipeline
+    configuration, the stage function, the name of the output dataset and a
+    flag that determines whether the output is written to disk."""
+
+    def __init__(self, name, function, output_name, persist=False):
+        self.name = name
+        self.function = function
+        self.output_name = output_name
+        self.persist = persist
+        self.options = None
+        self.dataset = None
+
+    def __str__(self):
+        return "<Stage %s %s%s>" % (self.name, self.output_name,
+                                    ' persist' if self.persist else '')
+
+
+class StageChain(object):
+
+    """Runs the stages on documents, see the module docstring. The stages have
+    to follow each other directly in rconfig.pipeline. The version_id is used
+    for all persisted datasets."""
+
+    def __init__(self, rconfig, stages, input_dataset=None, version_id='01',
+                 compress=True, progress=None):
+        self.rconfig = rconfig
+        self.stages = stages
+        self.input_dataset = input_dataset
+        self.version_id = version_id
+        self.compress = compress
+        self.progress = progress
+        self.stages[-1].persist = True
+        self._check_stages()
+        for stage in self.stages:
+            stage.options = rconfig.get_options(stage.name)
+            if stage.persist:
+                stage.dataset = DataSet(stage.name, stage.output_name, rconfig, version_id)
+                if not stage.dataset.exists():
+                    stage.dataset.initialize_on_disk()
+
+    def __str__(self):
+        return "<StageChain %s>" % ' '.join([stage.name for stage in self.stages])
+
+    def _check_stages(self):
+        names = [step[0] for step in self.rconfig.pipeline]
+        try:
+            first = names.index(self.stages[0].name)
+        except ValueError:
+            raise ValueError("stage %s is not in the pipeline" % self.stages[0].name)
+        if names[first:first + len(self.stages)] != [stage.name for stage in self.stages]:
+            raise ValueError("stages %s are not consecutive in the pipeline"
+                             % ' '.join([stage.name for stage in self.stages]))
+
+    def persisted_datasets(self):
+        return [stage.dataset for stage in self.stages if stage.persist]
+
+    def read_input(self, fspec):
+        """Return the content of the input document for fspec, or None if it
+        does not exist."""
+        if self.input_dataset is None:
+            filename = fspec.source if fspec.source is not None else fspec.target
+        else:
+            filename = os.path.join(self.input_dataset.path, 'files', fspec.target)
+        fh = open_input_file(filename)
+        if fh is None:
+            return None
+        text = fh.read()
+        fh.close()
+        return text
+
+    def process_document(self, fspec):
+        """Run all stages on the document of fspec, writing the output of the
+        persisted stages. Returns False if the document was dropped."""
+        text = self.read_input(fspec)
+        for stage in self.stages:
+            if text is None:
+                return False
+            text = stage.function(text, fspec, stage.options)
+            if stage.persist and text is not None:
+                filename = os.path.join(stage.dataset.path, 'files', fspec.target)
+                ensure_path(os.path.dirname(filename))
+                fh = open_output_file(filename, compress=self.compress)
+                fh.write(text)
+                fh.close()
+        return text is not None
+
+    def process(self, fspecs):
+        """Run the chain on the documents of a list of FileSpecs and update the
+        state of the persisted datasets. Returns the number of documents that
+        made it through all stages."""
+        t1 = time.time()
+        completed = 0
+        for fspec in fspecs:
+            if self.process_document(fspec):
+                completed += 1
+            if self.progress is not None:
+                self.progress.tick(fspec.target)
+        for dataset in self.persisted_datasets():
+            dataset.files_processed += len(fspecs)
+            dataset.update_state(len(fspecs), t1)
+        return completed
+
+    def process_filelist(self, filelist, start=0, limit=500):
+        """Run the chain on limit files from filelist, starting at line start,
+        like a stage that uses get_lines()."""
+        return self.process(get_lines(filelist, start, limit))
@@ -0,0 +1,170 @@
+"""
+
+Registry of compression codecs.
+
+Files in datasets are gzipped by default. Other codecs can be selected for a
+dataset with the compression setting in the general configuration of a corpus,
+and optionally compression_level:
+
+   compression=bz2
+   compression_level=9
+
+The codec is stored in config/compression.txt of a dataset when the dataset is
+initialized, and open_output_file() in path.py uses it for all files written to
+the dataset. Readers do not need to know the codec, open_input_file() and
+read_input_data() find files by their extension and recognize compressed data
+by its magic bytes.
+
+The following codecs are available:
+
+   name   extension   module
+   gz     .gz         gzip
+   bz2    .bz2        bz2
+   xz     .xz         lzma or backports.lzma, if installed
+   lz4    .lz4        lz4.frame, if installed
+
+The lz4 codec is much faster than gzip, especially for decompression, at the
+cost of larger files, which makes it a good choice for intermediate datasets
+that are read many times. Codecs whose module is not installed are not
+registered, get_codec() raises a ValueError for them.
+
+The name of the codec is also what packed storage uses in its index, with
+'raw' for uncompressed data.
+
+"""
+
+import re, gzip, bz2
+from io import BytesIO
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+
+DEFAULT_CODEC = 'gz'
+
+# number of bytes that detect_codec() needs
+MAGIC_SIZE = 10
+
+
+class Codec(object):
+
+    """A compression codec with a name, a filename extension and the magic
+    bytes at the start of compressed data, given as a regular expression. The
+    functions open a file for reading ('rb') or writing ('wb'), compress a
+    string and decompress a string. The level is handed to the functions if
+    it is not None."""
+
+    def __init__(self, name, extension, magic, open_file, compress, decompress):
+        self.name = name
+        self.extension = extension
+        self.magic = re.compile(magic)
+        self._open_file = open_file
+        self._compress = compress
+        self._decompress = decompress
+
+    def __str__(self):
+        return "<Codec %s>" % self.name
+
+    def open(self, filename, mode='rb', level=None):
+        return self._open_file(filename, mode, level)
+
+    def compress(self, data, level=None):
+        return self._compress(data, level)
+
+    def decompress(self, data):
+        return self._decompress(data)
+
+    def open_data(self, data):
+        """Return a file object on the decompressed data."""
+        if self.name == 'gz':
+            # stream gzip data rather than decompressing it all at once
+            return gzip.GzipFile(fileobj=BytesIO(data))
+        return BytesIO(self.decompress(data))
+
+
+def _gzip_open(filename, mode, level):
+    return gzip.open(filename, mode, 6 if level is None else level)
+
+def _gzip_compress(data, level):
+    buf = BytesIO()
+    gzipfile = gzip.GzipFile(filename='', mode='wb', fileobj=buf,
+                             compresslevel=6 if level is None else level)
+    gzipfile.write(data)
+    gzipfile.close()
+    return buf.getvalue()
+
+def _gzip_decompress(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+def _bz2_open(filename, mode, level):
+    return bz2.BZ2File(filename, mode, compresslevel=9 if level is None else level)
+
+def _bz2_compress(data, level):
+    return bz2.compress(data, 9 if level is None else level)
+
+def _xz_open(filename, mode, level):
+    return lzma.LZMAFile(filename, mode, preset=level if 'w' in mode else None)
+
+def _xz_compress(data, level):
+    return lzma.compress(data, preset=level)
+
+def _lz4_open(filename, mode, level):
+    return lz4frame.open(filename, mode, compression_level=0 if level is None else level)
+
+def _lz4_compress(data, level):
+    return lz4frame.compress(data, compression_level=0 if level is None else level)
+
+
+# codecs in the order in which open_input_file() looks for their extensions
+CODECS = []
+_codecs = {}
+
+def register_codec(codec):
+    CODECS.append(codec)
+    _codecs[codec.name] = codec
+
+register_codec(Codec('gz', '.gz', '\x1f\x8b', _gzip_open, _gzip_compress, _gzip_decompress))
+if lz4frame is not None:
+    register_codec(Codec('lz4', '.lz4', '\x04\x22\x4d\x18',
+                         _lz4_open, _lz4_compress, lz4frame.decompress))
+# the magic of a bz2 stream is followed by the block size and the magic of a
+# block or of the end of the stream
+register_codec(Codec('bz2', '.bz2', 'BZh[1-9](1AY&SY|\x17rE8P\x90)',
+                     _bz2_open, _bz2_compress, bz2.decompress))
+if lzma is not None:
+    register_codec(Codec('xz', '.xz', '\xfd7zXZ\x00', _xz_open, _xz_compress, lzma.decompress))
+
+
+def get_codec(name):
+    """Return the codec with name, raises a ValueError if there is no such
+    codec or if its module is not installed."""
+    codec = _codecs.get(name)
+    if codec is None:
+        raise ValueError("compression codec not available: %s" % name)
+    return codec
+
+def codec_for_filename(filename):
+    """Return the codec for the extension of filename, or None."""
+    for codec in CODECS:
+        if filename.endswith(codec.extension):
+            return codec
+    return None
+
+def detect_codec(data):
+    """Return the codec for data, which can be just the first MAGIC_SIZE bytes
+    of a file, or None if data does not start with the magic bytes of a
+    codec."""
+    for codec in CODECS:
+        if codec.magic.match(data):
+            return codec
+    return None
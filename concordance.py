@@ -0,0 +1,247 @@
+"""
+
+Creating concordances from term instances.
+
+The ConcordanceWriter takes a stream of TermInstances, groups them on the term
+and writes them out as a set of paginated html pages or as a tab-separated
+file. Typical usage:
+
+   instances = dataset_term_instances(tag_dataset, feat_dataset, filelist)
+   writer = ConcordanceWriter(page_size=500)
+   writer.add_instances(instances)
+   writer.write_html('concordance')
+   writer.write_tsv('concordance.txt')
+   writer.close()
+
+The html output is a directory with an index page that lists all terms with
+their frequencies and links into the concordance pages. Terms are sorted
+alphabetically and each page contains at most page_size lines.
+
+Only the rendered strings are kept for each instance. The left context, the
+token and the right context are sliced from the Sentence that FileData shares
+between all instances in a sentence, so sentences are not joined again for
+each instance. At most buffer_size lines are kept in memory, when the buffer
+is full its lines are sorted on the term and spilled to a temporary file. The
+writers merge the sorted temporary files, so only the number of instances of
+each term is kept for the whole dataset. The temporary files are removed by
+close().
+
+"""
+
+import os, sys, codecs, heapq, marshal, tempfile
+from cgi import escape
+
+from path import filename_generator, ensure_path, FileData
+from html import HtmlDocument
+
+
+def dataset_term_instances(tag_dataset, feat_dataset, filelist, terms=None):
+    """Generate all TermInstances from the documents in filelist, using the tag
+    and phr_feats files from two DataSets. If terms is given, then only
+    instances of those terms are generated."""
+    tag_files = filename_generator(tag_dataset.path, filelist)
+    feat_files = filename_generator(feat_dataset.path, filelist)
+    for tag_file, feat_file in zip(tag_files, feat_files):
+        fd = FileData(tag_file, feat_file)
+        for term in fd.get_terms():
+            if terms is not None and term not in terms:
+                continue
+            for instance in fd.get_term(term).term_instances:
+                yield instance
+
+
+class ConcordanceWriter(object):
+
+    """Collects concordance lines for term instances and writes them to html
+    pages or a tab-separated file. Lines that do not fit in a buffer of
+    buffer_size lines go to temporary files in tmp_dir."""
+
+    def __init__(self, page_size=500, title='Concordance', buffer_size=100000,
+                 tmp_dir=None):
+        self.page_size = page_size
+        self.title = title
+        self.buffer_size = buffer_size
+        self.tmp_dir = tmp_dir
+        self.counts = {}
+        self.instances = 0
+        self.buffer = []
+        self.runs = []
+
+    def __str__(self):
+        return "<ConcordanceWriter terms=%d instances=%d>" \
+            % (len(self.counts), self.instance_count())
+
+    def instance_count(self):
+        return self.instances
+
+    def add_instances(self, instances):
+        for instance in instances:
+            self.add_instance(instance)
+
+    def add_instance(self, instance):
+        # the instance number keeps the lines of a term in the order they were
+        # added when the lines are sorted on the term
+        line = (instance.term, self.instances, instance.year, instance.id,
+                instance.sec_loc, instance.context_left(),
+                instance.context_token(), instance.context_right())
+        self.counts[instance.term] = self.counts.get(instance.term, 0) + 1
+        self.instances += 1
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        """Write the sorted buffer to a new temporary file."""
+        fd, filename = tempfile.mkstemp(prefix='concordance-', dir=self.tmp_dir)
+        fh = os.fdopen(fd, 'wb')
+        for line in sorted(self.buffer):
+            marshal.dump(line, fh)
+        fh.close()
+        self.runs.append(filename)
+        self.buffer = []
+
+    def lines(self):
+        """Generate all lines sorted on the term, as tuples of term, year,
+        identifier, section, left context, token and right context."""
+        self.buffer.sort()
+        runs = [_read_run(filename) for filename in self.runs] + [iter(self.buffer)]
+        for line in heapq.merge(*runs):
+            yield line[:1] + line[2:]
+
+    def close(self):
+        """Remove the temporary files."""
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+        self.buffer = []
+        self.counts = {}
+        self.instances = 0
+
+    def write_tsv(self, filename):
+        """Write all lines to filename, one instance per line, with the term in
+        the first column, followed by year, identifier, section, left context,
+        term and right context."""
+        fh = codecs.open(filename, 'w', encoding='utf-8')
+        for line in self.lines():
+            fh.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % line)
+        fh.close()
+
+    def write_html(self, directory):
+        """Write an index page and the concordance pages to directory. Lines
+        for a term can be spread out over more than one page."""
+        ensure_path(directory)
+        pages = self._paginate()
+        index = {}
+        for page_number, page in enumerate(pages):
+            for term, first, last in page:
+                index.setdefault(term, page_number)
+        self._write_index(directory, index)
+        lines = self.lines()
+        for page_number, page in enumerate(pages):
+            self._write_page(directory, page, lines, page_number, len(pages))
+
+    def _paginate(self):
+        """Return a list of pages, where each page is a list of triples of
+        term, first line and last line."""
+        pages = []
+        page = []
+        room = self.page_size
+        for term in sorted(self.counts):
+            first = 0
+            total = self.counts[term]
+            while first < total:
+                last = min(total, first + room)
+                page.append((term, first, last))
+                room -= last - first
+                first = last
+                if room == 0:
+                    pages.append(page)
+                    page = []
+                    room = self.page_size
+        if page:
+            pages.append(page)
+        return pages
+
+    def _new_document(self, title):
+        doc = HtmlDocument(title=title)
+        doc.add_style('.term', 'color: blue')
+        doc.add_style('.meta', 'color: gray', 'font-size: 10pt')
+        return doc
+
+    def _write_index(self, directory, index):
+        doc = self._new_document(self.title)
+        doc.add_header(None, escape(self.title))
+        doc.add_paragraph(None, "%d terms, %d instances"
+                          % (len(self.counts), self.instance_count()))
+        table = doc.add_table(padding=3)
+        table.add_row(('term',), ('right', 'instances'))
+        for term in sorted(self.counts):
+            link = "<a href='%s#%s'>%s</a>" \
+                % (_page_name(index[term]), _anchor(term), escape(term))
+            table.add_row((link,), ('right', str(self.counts[term])))
+        _print_document(doc, os.path.join(directory, 'index.html'))
+
+    def _write_page(self, directory, page, lines, page_number, number_of_pages):
+        """Write a page, taking its lines from lines, a generator of sorted
+        lines that continues where the previous page stopped."""
+        doc = self._new_document("%s - page %d" % (self.title, page_number + 1))
+        doc.add_text(_navigation(page_number, number_of_pages))
+        for term, first, last in page:
+            if first == 0:
+                doc.add_text("<a name='%s'></a>" % _anchor(term))
+            doc.add_header('term', "%s (%d-%d of %d)"
+                           % (escape(term), first + 1, last, self.counts[term]))
+            table = doc.add_table(padding=3, border=0)
+            for i in range(first, last):
+                (term, year, id, section, left, token, right) = lines.next()
+                table.add_row(("<span class='meta'>%s %s %s</span>"
+                               % (year, escape(id), section),),
+                              ('right', escape(left)),
+                              ('center', "<span class='term'>%s</span>" % escape(token)),
+                              (escape(right),))
+        doc.add_text(_navigation(page_number, number_of_pages))
+        _print_document(doc, os.path.join(directory, _page_name(page_number)))
+
+
+def _read_run(filename):
+    fh = open(filename, 'rb')
+    while True:
+        try:
+            yield marshal.load(fh)
+        except EOFError:
+            break
+    fh.close()
+
+def _page_name(page_number):
+    return "page-%05d.html" % (page_number + 1)
+
+def _anchor(term):
+    return escape(term.replace(' ', '_'), True)
+
+def _navigation(page_number, number_of_pages):
+    links = ["<a href='index.html'>index</a>"]
+    if page_number > 0:
+        links.append("<a href='%s'>previous</a>" % _page_name(page_number - 1))
+    if page_number < number_of_pages - 1:
+        links.append("<a href='%s'>next</a>" % _page_name(page_number + 1))
+    return "<p>%s</p>" % ' | '.join(links)
+
+def _print_document(doc, filename):
+    fh = codecs.open(filename, 'w', encoding='utf-8')
+    doc.print_html(fh)
+    fh.close()
+
+
+
+if __name__ == '__main__':
+
+    # usage: python concordance.py TAG_FILE FEAT_FILE OUTPUT_DIRECTORY
+    tag_file, feat_file, directory = sys.argv[1:4]
+    writer = ConcordanceWriter(title=os.path.basename(tag_file))
+    fd = FileData(tag_file, feat_file)
+    for term in fd.get_terms():
+        writer.add_instances(fd.get_term(term).term_instances)
+    writer.write_html(directory)
+    writer.write_tsv(os.path.join(directory, 'concordance.txt'))
+    print writer
+    writer.close()
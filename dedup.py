@@ -0,0 +1,275 @@
+"""
+
+Finding near-duplicate documents.
+
+Patent corpora contain many documents that are almost identical, for example
+continuations and re-publications. The DuplicateFinder finds clusters of
+near-duplicates with MinHash signatures and locality-sensitive hashing, so that
+later stages can process only one representative of each cluster:
+
+   finder = DuplicateFinder(filelist, tag_dataset, threshold=0.8, processes=8)
+   finder.run()
+   finder.write_clusters('duplicates.txt')
+   finder.write_filelist('files-dedup.txt')
+
+Documents are compared on their sets of shingles, which are sequences of
+shingle_size tokens. Tokens are taken from the tag files of a dataset, read
+with read_tag_file(), or, if no dataset is given, from the source files in the
+file list, where xml tags are removed and the text is split on whitespace.
+
+For each document a signature of num_perm minimum hash values is computed, the
+fraction of positions where two signatures agree estimates the Jaccard
+similarity of the shingle sets. Signatures are split into bands and documents
+with identical values for a band become candidate pairs. Candidates whose
+estimated similarity is at least threshold are put in the same cluster. With
+more bands, more pairs with a similarity below the threshold become candidates,
+which costs time but misses fewer duplicates. Signatures are computed for
+shards of the file list in a pool of processes. NumPy is used for computing
+signatures if it is installed, in which case the hash functions are computed
+modulo 2**64, so signatures computed with and without NumPy cannot be
+compared. Empty and missing documents are never put in a cluster.
+
+Clusters are keyed on the FileSpec target of their representative, which is
+the document that comes first in the file list. The deduplicated file list has
+the lines of the original file list for all documents that are not in a cluster
+or that represent a cluster.
+
+"""
+
+import os, sys, re, zlib, random
+from multiprocessing import Pool
+
+from path import FileSpec, open_input_file, read_tag_file, file_exists
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+XML_TAG = re.compile(r'<[^>]*>')
+
+
+def tag_file_tokens(tag_file):
+    """Return the tokens of all sentences in a tag file, or an empty list if
+    the tag file does not exist."""
+    tokens = []
+    if not file_exists(tag_file):
+        return tokens
+    for sentence in read_tag_file(tag_file, keep_tags=False)[0]:
+        tokens.extend(sentence.tokens)
+    return tokens
+
+def source_file_tokens(source_file):
+    """Return the whitespace-separated tokens of a source file, after removing
+    xml tags."""
+    fh = open_input_file(source_file)
+    if fh is None:
+        return []
+    text = fh.read()
+    fh.close()
+    return XML_TAG.sub(u' ', text).split()
+
+def shingles(tokens, shingle_size=5):
+    """Return the set of hashes of all sequences of shingle_size tokens. A
+    document with fewer tokens has the whole document as its only shingle, an
+    empty document has no shingles."""
+    hashes = set()
+    if not tokens:
+        return hashes
+    for i in range(max(1, len(tokens) - shingle_size + 1)):
+        shingle = u' '.join(tokens[i:i + shingle_size]).encode('utf-8')
+        hashes.add(zlib.crc32(shingle) & MAX_HASH)
+    return hashes
+
+
+class MinHasher(object):
+
+    """Computes MinHash signatures with num_perm hash functions of the form
+    (a * x + b) mod p, where the a and b are drawn with the seed so that all
+    processes use the same functions."""
+
+    def __init__(self, num_perm=64, seed=1):
+        self.num_perm = num_perm
+        rng = random.Random(seed)
+        self.a = [rng.randint(1, MERSENNE_PRIME - 1) for i in range(num_perm)]
+        self.b = [rng.randint(0, MERSENNE_PRIME - 1) for i in range(num_perm)]
+        if numpy is not None:
+            # keep intermediate products below 2**64 by reducing a and b to 32 bits
+            self.np_a = numpy.array([a & MAX_HASH for a in self.a], dtype=numpy.uint64)
+            self.np_b = numpy.array([b & MAX_HASH for b in self.b], dtype=numpy.uint64)
+
+    def __str__(self):
+        return "<MinHasher num_perm=%d>" % self.num_perm
+
+    def signature(self, hashes):
+        """Return the signature of a set of shingle hashes as a tuple, or None
+        if there are no hashes."""
+        if not hashes:
+            return None
+        if numpy is not None:
+            values = numpy.array(list(hashes), dtype=numpy.uint64)
+            products = numpy.outer(values, self.np_a) + self.np_b
+            return tuple(int(v) for v in ((products >> numpy.uint64(32)) ^ products).min(axis=0)
+                         & numpy.uint64(MAX_HASH))
+        return tuple(min(((a * x + b) % MERSENNE_PRIME) & MAX_HASH for x in hashes)
+                     for (a, b) in zip(self.a, self.b))
+
+
+def similarity(signature1, signature2):
+    """Return the estimated Jaccard similarity of two signatures."""
+    same = sum(1 for (v1, v2) in zip(signature1, signature2) if v1 == v2)
+    return float(same) / len(signature1)
+
+
+class DuplicateFinder(object):
+
+    """Finds clusters of near-duplicates in the documents of filelist, see the
+    module docstring. The number of bands has to divide num_perm."""
+
+    def __init__(self, filelist, dataset=None, threshold=0.8, num_perm=64,
+                 bands=16, shingle_size=5, processes=4, shard_size=500, seed=1):
+        if num_perm % bands:
+            raise ValueError("number of bands does not divide num_perm")
+        self.filelist = filelist
+        self.dataset = dataset
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.processes = processes
+        self.shard_size = shard_size
+        self.seed = seed
+        self.lines = []
+        self.signatures = []
+        self.clusters = {}
+
+    def __str__(self):
+        return "<DuplicateFinder %s documents=%d clusters=%d>" \
+            % (self.filelist, len(self.lines), len(self.clusters))
+
+    def read_filelist(self):
+        self.lines = []
+        for line in open(self.filelist):
+            if line.strip() and not line.startswith('#'):
+                self.lines.append(line.rstrip("\n"))
+
+    def input_file(self, fspec):
+        if self.dataset is None:
+            return fspec.source if fspec.source is not None else fspec.target
+        return os.path.join(self.dataset.path, 'files', fspec.target)
+
+    def compute_signatures(self):
+        """Compute the signatures of all documents, in file list order."""
+        use_tags = self.dataset is not None
+        files = [self.input_file(FileSpec(line)) for line in self.lines]
+        tasks = [(files[i:i + self.shard_size], use_tags, self.shingle_size,
+                  self.num_perm, self.seed)
+                 for i in range(0, len(files), self.shard_size)]
+        if self.processes < 2:
+            results = [_shard_signatures(task) for task in tasks]
+        else:
+            pool = Pool(self.processes)
+            results = pool.map(_shard_signatures, tasks)
+            pool.close()
+            pool.join()
+        self.signatures = [signature for result in results for signature in result]
+
+    def find_clusters(self):
+        """Group documents with a similar signature in clusters, using a
+        union-find structure on document numbers."""
+        parents = range(len(self.signatures))
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            buckets = {}
+            for doc, signature in enumerate(self.signatures):
+                if signature is None:
+                    continue
+                key = signature[band * rows:(band + 1) * rows]
+                buckets.setdefault(key, []).append(doc)
+            for docs in buckets.values():
+                # all pairs in a bucket are candidates, but pairs that are
+                # already in the same cluster do not have to be compared
+                for i, doc in enumerate(docs):
+                    for other in docs[:i]:
+                        root1, root2 = find(other), find(doc)
+                        if root1 == root2:
+                            continue
+                        if similarity(self.signatures[other], self.signatures[doc]) >= self.threshold:
+                            # the document that is first in the file list stays root
+                            parents[max(root1, root2)] = min(root1, root2)
+        members = {}
+        for doc in range(len(self.signatures)):
+            members.setdefault(find(doc), []).append(doc)
+        self.clusters = {}
+        for root, docs in members.items():
+            if len(docs) > 1:
+                targets = [FileSpec(self.lines[doc]).target for doc in docs]
+                self.clusters[targets[0]] = targets
+        return self.clusters
+
+    def run(self):
+        """Read the file list, compute the signatures and find the clusters.
+        Returns a dictionary with the clusters, indexed on the target of the
+        representative and with a list of all targets in the cluster as the
+        value."""
+        self.read_filelist()
+        self.compute_signatures()
+        return self.find_clusters()
+
+    def duplicates(self):
+        """Return the set of targets that are in a cluster but do not represent
+        it."""
+        return set([target for targets in self.clusters.values() for target in targets[1:]])
+
+    def write_clusters(self, filename):
+        """Write the clusters to filename, one line for each cluster with the
+        tab-separated targets, starting with the representative."""
+        fh = open(filename, 'w')
+        for representative in sorted(self.clusters):
+            fh.write("\t".join(self.clusters[representative]) + "\n")
+        fh.close()
+
+    def write_filelist(self, filename):
+        """Write the lines of the file list without the duplicates to filename.
+        Returns the number of lines written."""
+        duplicates = self.duplicates()
+        count = 0
+        fh = open(filename, 'w')
+        for line in self.lines:
+            if FileSpec(line).target not in duplicates:
+                fh.write(line + "\n")
+                count += 1
+        fh.close()
+        return count
+
+
+def _shard_signatures(task):
+    (files, use_tags, shingle_size, num_perm, seed) = task
+    minhasher = MinHasher(num_perm, seed)
+    signatures = []
+    for filename in files:
+        tokens = tag_file_tokens(filename) if use_tags else source_file_tokens(filename)
+        signatures.append(minhasher.signature(shingles(tokens, shingle_size)))
+    return signatures
+
+
+
+if __name__ == '__main__':
+
+    # usage: python dedup.py FILELIST OUTPUT_FILELIST [PROCESSES]
+    # finds near-duplicates among the source files in FILELIST
+    filelist, output = sys.argv[1:3]
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    finder = DuplicateFinder(filelist, processes=processes)
+    finder.run()
+    print finder
+    print "Wrote %d files to %s" % (finder.write_filelist(output), output)
@@ -0,0 +1,416 @@
+"""
+
+Binary cache for phr_feats datasets.
+
+Each classifier experiment parses the same phr_feats files again. This module
+converts a phr_feats dataset into a binary cache once, after which the term
+instances can be read with no parsing. The cache is a directory, by default the
+cache directory inside the dataset, with vocabularies, column files and a file
+with meta data:
+
+   meta.txt          dataset state and pipeline the cache was created from
+   terms.txt         term vocabulary, one term per line
+   features.txt      feature vocabulary, one name=value string per line
+   sections.txt      section vocabulary
+   years.txt         year vocabulary
+   docs.txt          target and identifier prefix of all documents
+
+   doc_offsets.col   for each document the index of its first instance
+   term.col          for each instance the term id
+   doc.col           for each instance the document number
+   year.col          for each instance the year id
+   idnum.col         for each instance the number at the end of its identifier
+   doc_loc.col       for each instance the sentence number
+   tok1.col          for each instance the first token
+   tok2.col          for each instance the token end
+   section.col       for each instance the section id
+   feat_offsets.col  for each instance the index of its first feature id
+   feat_ids.col      feature ids of all instances
+
+Column files contain native-order binary integers and are memory-mapped when
+read. If NumPy is available, columns are NumPy arrays on the memory map,
+otherwise values are unpacked from the memory map when they are accessed. All
+features of an instance are in the feature list, including the location
+features that are also available in separate columns.
+
+Creating and using a cache:
+
+   cache = build_feats_cache(dataset, filelist)
+   cache = FeatsCache(cache_dir)
+   if cache.is_valid(dataset, filelist):
+       for doc in range(cache.number_of_documents()):
+           for (id, year, term, feats) in cache.document_instances(doc):
+               ...
+
+"""
+
+import os, sys, mmap, struct, shutil, codecs, hashlib
+from array import array
+
+from path import open_input_file, FileSpec, parse_feats_line
+from path import ensure_path
+from batch import pipeline_component_as_string
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+CACHE_VERSION = '1'
+
+# column name, struct format character and size in bytes
+COLUMNS = (('doc_offsets', 'Q', 8),
+           ('term', 'I', 4),
+           ('doc', 'I', 4),
+           ('year', 'H', 2),
+           ('idnum', 'i', 4),
+           ('doc_loc', 'i', 4),
+           ('tok1', 'i', 4),
+           ('tok2', 'i', 4),
+           ('section', 'H', 2),
+           ('feat_offsets', 'Q', 8),
+           ('feat_ids', 'I', 4))
+
+NUMPY_TYPES = { 'Q': 'uint64', 'I': 'uint32', 'H': 'uint16', 'i': 'int32' }
+
+
+def _array_typecode(fmt, size):
+    """Return the array typecode for integers of the given size that are signed
+    if the struct format fmt is lower case."""
+    codes = 'bhilq' if fmt.islower() else 'BHILQ'
+    for code in codes:
+        try:
+            if array(code).itemsize == size:
+                return code
+        except ValueError:
+            pass
+    raise ValueError("no array type for %s" % fmt)
+
+
+def dataset_state(dataset, filelist):
+    """Return a dictionary that describes the state of a dataset, used to check
+    whether the cache was made from the same data."""
+    return { 'version': CACHE_VERSION,
+             'byteorder': sys.byteorder,
+             'files_processed': str(dataset.files_processed),
+             'pipeline': _digest(pipeline_component_as_string(
+                 dataset.pipeline_trace + [dataset.pipeline_head])),
+             'filelist': _digest(open(filelist).read()) }
+
+def _digest(text):
+    return hashlib.md5(text).hexdigest()
+
+def build_feats_cache(dataset, filelist, cache_dir=None):
+    """Create the cache for all files in filelist from a phr_feats dataset and
+    return a FeatsCache on it. The cache is first written to a temporary
+    directory which replaces an existing cache when it is complete."""
+    if cache_dir is None:
+        cache_dir = os.path.join(dataset.path, 'cache')
+    tmp_dir = cache_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    ensure_path(tmp_dir)
+    writer = _CacheWriter(tmp_dir)
+    fh = open(filelist)
+    for line in fh:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        target = FileSpec(line).target
+        writer.add_document(target, open_input_file(
+            os.path.join(dataset.path, 'files', target)))
+    fh.close()
+    writer.close(dataset_state(dataset, filelist))
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+    return FeatsCache(cache_dir)
+
+
+class Vocabulary(object):
+
+    """Maps strings to integer identifiers and back. A vocabulary is stored
+    as a utf-8 text file with one string per line, where the identifier is the
+    line number, starting at 0."""
+
+    def __init__(self, strings=None):
+        self.strings = []
+        self.ids = {}
+        if strings is not None:
+            for string in strings:
+                self.get_id(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, id):
+        return self.strings[id]
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __getstate__(self):
+        # the identifiers are rebuilt from the strings when unpickling
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.__init__(strings)
+
+    def get_id(self, string, add=True):
+        """Return the identifier for string. If string is not in the
+        vocabulary, add it or return None if add is False."""
+        id = self.ids.get(string)
+        if id is None and add:
+            id = len(self.strings)
+            self.strings.append(string)
+            self.ids[string] = id
+        return id
+
+    def save(self, filename):
+        fh = codecs.open(filename, 'w', encoding='utf-8')
+        for string in self.strings:
+            fh.write(string + u"\n")
+        fh.close()
+
+    @classmethod
+    def load(cls, filename):
+        # split on newlines only, iterating over a codecs reader would also
+        # split on characters like u'\x85' and u'\u2028'
+        fh = open(filename, 'rb')
+        lines = fh.read().decode('utf-8').split(u"\n")
+        fh.close()
+        if lines and lines[-1] == u'':
+            lines.pop()
+        return cls(lines)
+
+
+class _CacheWriter(object):
+
+    """Writes the vocabularies and columns of a cache. Column values are
+    collected in arrays that are appended to the column files when they
+    grow large."""
+
+    FLUSH_SIZE = 1000000
+
+    def __init__(self, cache_dir):
+        self.dir = cache_dir
+        self.vocabularies = dict((name, Vocabulary())
+                                 for name in ('terms', 'features', 'sections', 'years'))
+        self.docs = []
+        self.instances = 0
+        self.feature_count = 0
+        self.columns = {}
+        self.files = {}
+        for name, fmt, size in COLUMNS:
+            self.columns[name] = array(_array_typecode(fmt, size))
+            self.files[name] = open(os.path.join(cache_dir, name + '.col'), 'wb')
+
+    def add_document(self, target, fh):
+        doc = len(self.docs)
+        id_prefix = None
+        self.columns['doc_offsets'].append(self.instances)
+        if fh is not None:
+            for line in fh:
+                (id, year, term, feats) = parse_feats_line(line)
+                prefix, idnum = _split_id(id)
+                if id_prefix is None:
+                    id_prefix = prefix
+                elif prefix != id_prefix:
+                    raise ValueError("unexpected identifier %s in %s" % (id, target))
+                self._add_instance(doc, idnum, year, term, feats)
+            fh.close()
+        self.docs.append((target, id_prefix or ''))
+        if len(self.columns['term']) > self.FLUSH_SIZE:
+            self._flush()
+
+    def _add_instance(self, doc, idnum, year, term, feats):
+        columns = self.columns
+        vocabularies = self.vocabularies
+        doc_loc = feats.get('doc_loc', '-1')
+        sent_loc = feats.get('sent_loc')
+        tok1, tok2 = sent_loc.split('-') if sent_loc else (-1, -1)
+        columns['term'].append(vocabularies['terms'].get_id(term))
+        columns['doc'].append(doc)
+        columns['year'].append(vocabularies['years'].get_id(year))
+        columns['idnum'].append(idnum)
+        columns['doc_loc'].append(int(doc_loc[4:] if doc_loc.startswith('sent') else doc_loc))
+        columns['tok1'].append(int(tok1))
+        columns['tok2'].append(int(tok2))
+        columns['section'].append(vocabularies['sections'].get_id(feats.get('section_loc', '')))
+        columns['feat_offsets'].append(self.feature_count)
+        features = vocabularies['features']
+        for feat, val in feats.items():
+            columns['feat_ids'].append(features.get_id(feat + '=' + val))
+        self.feature_count += len(feats)
+        self.instances += 1
+
+    def _flush(self):
+        for name, column in self.columns.items():
+            column.tofile(self.files[name])
+            del column[:]
+
+    def close(self, state):
+        self.columns['doc_offsets'].append(self.instances)
+        self.columns['feat_offsets'].append(self.feature_count)
+        self._flush()
+        for fh in self.files.values():
+            fh.close()
+        for name, vocabulary in self.vocabularies.items():
+            vocabulary.save(os.path.join(self.dir, name + '.txt'))
+        fh = codecs.open(os.path.join(self.dir, 'docs.txt'), 'w', encoding='utf-8')
+        for target, id_prefix in self.docs:
+            fh.write(u"%s\t%s\n" % (target, id_prefix))
+        fh.close()
+        state = dict(state)
+        state['documents'] = str(len(self.docs))
+        state['instances'] = str(self.instances)
+        fh = open(os.path.join(self.dir, 'meta.txt'), 'w')
+        for key in sorted(state):
+            fh.write("%s=%s\n" % (key, state[key]))
+        fh.close()
+
+
+def _split_id(id):
+    """Split an instance identifier like US6031898A.xml_12 into its prefix and
+    number. The number is -1 if the identifier does not end in a number."""
+    prefix, sep, number = id.rpartition('_')
+    if sep and number.isdigit():
+        return prefix, int(number)
+    return id, -1
+
+def _join_id(prefix, idnum):
+    return prefix if idnum < 0 else "%s_%d" % (prefix, idnum)
+
+
+class _Column(object):
+
+    """A column on a memory map, values are unpacked when accessed."""
+
+    def __init__(self, mm, fmt, size):
+        self.mm = mm
+        self.fmt = fmt
+        self.size = size
+        self.length = len(mm) // size if mm is not None else 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return struct.unpack_from('=' + self.fmt, self.mm, i * self.size)[0]
+
+    def slice(self, i, j):
+        if j <= i:
+            return ()
+        return struct.unpack_from("=%d%s" % (j - i, self.fmt), self.mm, i * self.size)
+
+
+class _NumpyColumn(object):
+
+    """A column that is a NumPy array on a memory map."""
+
+    def __init__(self, mm, fmt, size):
+        if mm is None:
+            self.values = numpy.zeros(0, dtype=NUMPY_TYPES[fmt])
+        else:
+            self.values = numpy.frombuffer(mm, dtype=NUMPY_TYPES[fmt])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return int(self.values[i])
+
+    def slice(self, i, j):
+        return self.values[i:j]
+
+
+class FeatsCache(object):
+
+    """Read access to a cache created by build_feats_cache(). Instance
+    variables include the vocabularies (terms, features, sections and years),
+    the list of documents with target and identifier prefix, the meta data and
+    the columns, which are accessible as attributes with the column name."""
+
+    def __init__(self, cache_dir):
+        self.dir = cache_dir
+        self.meta = {}
+        for line in open(os.path.join(cache_dir, 'meta.txt')):
+            key, val = line.rstrip("\n").split('=', 1)
+            self.meta[key] = val
+        if self.meta.get('byteorder') != sys.byteorder:
+            raise ValueError("cache in %s has a different byte order" % cache_dir)
+        self.terms = Vocabulary.load(os.path.join(cache_dir, 'terms.txt'))
+        self.features = Vocabulary.load(os.path.join(cache_dir, 'features.txt'))
+        self.sections = Vocabulary.load(os.path.join(cache_dir, 'sections.txt'))
+        self.years = Vocabulary.load(os.path.join(cache_dir, 'years.txt'))
+        self.docs = []
+        for line in open(os.path.join(cache_dir, 'docs.txt'), 'rb'):
+            self.docs.append(tuple(line.decode('utf-8').rstrip(u"\n").split(u"\t")))
+        self._files = []
+        column_class = _Column if numpy is None else _NumpyColumn
+        for name, fmt, size in COLUMNS:
+            setattr(self, name, column_class(self._map(name), fmt, size))
+
+    def __str__(self):
+        return "<FeatsCache %s documents=%d instances=%d>" \
+            % (self.dir, len(self.docs), len(self.term))
+
+    def _map(self, name):
+        fh = open(os.path.join(self.dir, name + '.col'), 'rb')
+        self._files.append(fh)
+        if os.fstat(fh.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def is_valid(self, dataset, filelist):
+        """Return True if the cache was created from the current state of the
+        dataset and from the same file list."""
+        state = dataset_state(dataset, filelist)
+        return all([self.meta.get(k) == v for k, v in state.items()])
+
+    def number_of_documents(self):
+        return len(self.docs)
+
+    def document_range(self, doc):
+        """Return the range of instance indexes for document number doc."""
+        return self.doc_offsets[doc], self.doc_offsets[doc + 1]
+
+    def instance_features(self, i):
+        """Return the feature ids of instance i."""
+        return self.feat_ids.slice(self.feat_offsets[i], self.feat_offsets[i + 1])
+
+    def document_instances(self, doc):
+        """Generate the instances of document number doc as tuples of id,
+        year, term and features dictionary, as returned by
+        parse_feats_line()."""
+        first, last = self.document_range(doc)
+        id_prefix = self.docs[doc][1]
+        terms = self.term.slice(first, last)
+        years = self.year.slice(first, last)
+        idnums = self.idnum.slice(first, last)
+        offsets = self.feat_offsets.slice(first, last + 1)
+        feat_ids = self.feat_ids.slice(offsets[0], offsets[-1])
+        base = offsets[0]
+        for n in range(last - first):
+            feats = {}
+            for feat_id in feat_ids[offsets[n] - base:offsets[n + 1] - base]:
+                feat, val = self.features[feat_id].split('=', 1)
+                feats[feat] = val
+            yield (_join_id(id_prefix, int(idnums[n])), self.years[years[n]],
+                   self.terms[terms[n]], feats)
+
+    def close(self):
+        for fh in self._files:
+            fh.close()
+
+
+
+if __name__ == '__main__':
+
+    # usage: python featcache.py CACHE_DIR
+    # prints the cache and the instances in its first document
+    cache = FeatsCache(sys.argv[1])
+    print cache
+    for instance in cache.document_instances(0):
+        print instance
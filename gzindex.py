@@ -0,0 +1,280 @@
+"""
+
+Random access to gzipped files.
+
+To read a line from the middle of a gzipped file, normally everything before
+that line has to be decompressed. This module creates an index for a gzipped
+file, stored next to it with an .idx extension, with which reading can start
+close to any uncompressed offset. The index contains:
+
+   members     compressed and uncompressed offsets of all gzip members
+   lines       uncompressed offsets of the beginning of all lines
+   sentences   line numbers of all sentences (lines that are not section
+               headers in tag files)
+   sections    section names with the number of their first sentence
+
+Reading starts at the beginning of the gzip member that contains the offset.
+The zlib module cannot restart decompression in the middle of a member, so a
+file that consists of a single member, which is what gzip.open() creates, has
+no useful seek points. Files written with the ParallelGzipWriter consist of
+many members, and make_seekable() rewrites a file with members of a given
+size:
+
+   make_seekable('data/d2_tag/01/files/2000/US1A.xml.gz', block_size=64*1024)
+   index = GzipIndex.load('data/d2_tag/01/files/2000/US1A.xml.gz')
+   fh = IndexedGzipFile('data/d2_tag/01/files/2000/US1A.xml.gz', index)
+   lines = fh.read_lines(100, 110)
+
+Usually, the index is used through open_input_file(), which takes an optional
+offset, and read_sentences() in path.py.
+
+"""
+
+import os, sys, zlib, json, gzip
+from bisect import bisect_right
+
+from pgzip import ParallelGzipWriter
+
+
+INDEX_VERSION = 2
+CHUNK_SIZE = 64 * 1024
+
+
+def index_filename(gzip_file):
+    return gzip_file + '.idx'
+
+def find_members(gzip_file):
+    """Return a list of (compressed offset, uncompressed offset) pairs for the
+    beginnings of all gzip members in gzip_file, and the total uncompressed
+    size."""
+    members = [(0, 0)]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    position = 0
+    uncompressed = 0
+    fh = open(gzip_file, 'rb')
+    while True:
+        data = fh.read(CHUNK_SIZE)
+        if not data:
+            break
+        while data:
+            uncompressed += len(decompressor.decompress(data))
+            unused = decompressor.unused_data
+            if not unused:
+                position += len(data)
+                break
+            # the member ended inside this chunk, the remainder of the chunk
+            # belongs to the next member, unless it is padding
+            position += len(data) - len(unused)
+            if not unused.strip('\x00'):
+                break
+            members.append((position, uncompressed))
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = unused
+    uncompressed += len(decompressor.flush())
+    fh.close()
+    return members, uncompressed
+
+def make_seekable(gzip_file, block_size=64 * 1024):
+    """Rewrite gzip_file with members of about block_size uncompressed bytes and
+    create its index."""
+    tmp_file = gzip_file + '.tmp'
+    reader = gzip.open(gzip_file, 'rb')
+    writer = ParallelGzipWriter(tmp_file, block_size=block_size, threads=1)
+    while True:
+        data = reader.read(block_size)
+        if not data:
+            break
+        writer.write(data)
+    reader.close()
+    writer.close()
+    os.rename(tmp_file, gzip_file)
+    return create_index(gzip_file)
+
+def create_index(gzip_file):
+    """Create the index for gzip_file, save it and return it."""
+    members, size = find_members(gzip_file)
+    lines = []
+    sentences = []
+    sections = []
+    offset = 0
+    fh = gzip.open(gzip_file, 'rb')
+    text = fh.read().decode('utf-8')
+    fh.close()
+    # lines are split like read_tag_file() in path.py splits them, which also
+    # breaks lines at characters like u'\x85' and u'\u2028', the offsets are
+    # in utf-8 bytes
+    for line in text.splitlines(True):
+        if line.startswith(u'FH_'):
+            sections.append((line.strip(), len(sentences)))
+        else:
+            sentences.append(len(lines))
+        lines.append(offset)
+        offset += len(line.encode('utf-8'))
+    index = GzipIndex(members, size, lines, sentences, sections)
+    index.save(index_filename(gzip_file))
+    return index
+
+
+class GzipIndex(object):
+
+    """The index of a gzip file, see the module docstring for its content."""
+
+    def __init__(self, members, size, lines, sentences, sections):
+        self.members = members
+        self.member_offsets = [m[1] for m in members]
+        self.size = size
+        self.lines = lines
+        self.sentences = sentences
+        self.sections = sections
+        self.section_starts = [s[1] for s in sections]
+
+    def __str__(self):
+        return "<GzipIndex members=%d lines=%d sentences=%d>" \
+            % (len(self.members), len(self.lines), len(self.sentences))
+
+    @classmethod
+    def load(cls, gzip_file):
+        """Return the index for gzip_file, or None if there is no index or if
+        the index is older than the file."""
+        idx_file = index_filename(gzip_file)
+        try:
+            if os.path.getmtime(idx_file) < os.path.getmtime(gzip_file):
+                return None
+        except OSError:
+            return None
+        data = json.load(open(idx_file))
+        if data.get('version') != INDEX_VERSION:
+            return None
+        return cls([tuple(m) for m in data['members']], data['size'],
+                   data['lines'], data['sentences'],
+                   [tuple(s) for s in data['sections']])
+
+    def save(self, idx_file):
+        data = { 'version': INDEX_VERSION, 'members': self.members,
+                 'size': self.size, 'lines': self.lines,
+                 'sentences': self.sentences, 'sections': self.sections }
+        fh = open(idx_file, 'w')
+        json.dump(data, fh, separators=(',', ':'))
+        fh.close()
+
+    def member_for_offset(self, offset):
+        """Return the (compressed offset, uncompressed offset) pair of the member
+        that contains the uncompressed offset."""
+        return self.members[bisect_right(self.member_offsets, offset) - 1]
+
+    def line_range(self, first, last):
+        """Return the uncompressed offsets of the beginning of line first and of
+        the end of line last - 1."""
+        start = self.lines[first]
+        end = self.lines[last] if last < len(self.lines) else self.size
+        return start, end
+
+    def section_of_sentence(self, sentence):
+        i = bisect_right(self.section_starts, sentence) - 1
+        return self.sections[i][0] if i >= 0 else None
+
+
+class MemberStream(object):
+
+    """Read-only stream over the uncompressed content of a gzip file starting
+    at a given uncompressed offset."""
+
+    def __init__(self, gzip_file, index, offset):
+        self.fh = open(gzip_file, 'rb')
+        member_coffset, member_uoffset = index.member_for_offset(offset)
+        self.fh.seek(member_coffset)
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = ''
+        self.eof = False
+        self._skip(offset - member_uoffset)
+
+    def _fill(self, size):
+        """Decompress until the buffer contains at least size bytes or the end
+        of the file was reached."""
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.fh.read(CHUNK_SIZE)
+            if not data:
+                self.buffer += self.decompressor.flush()
+                self.eof = True
+                break
+            while data:
+                self.buffer += self.decompressor.decompress(data)
+                data = self.decompressor.unused_data
+                if data:
+                    if not data.strip('\x00'):
+                        break
+                    self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _skip(self, n):
+        while n > 0:
+            self._fill(min(n, CHUNK_SIZE))
+            skipped = min(n, len(self.buffer))
+            if skipped == 0:
+                break
+            self.buffer = self.buffer[skipped:]
+            n -= skipped
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            result, self.buffer = self.buffer, ''
+        else:
+            result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def close(self):
+        self.fh.close()
+
+
+class IndexedGzipFile(object):
+
+    """Gives access to regions of a gzip file with an index."""
+
+    def __init__(self, gzip_file, index=None):
+        self.gzip_file = gzip_file
+        self.index = GzipIndex.load(gzip_file) if index is None else index
+        if self.index is None:
+            raise IOError("no index for %s" % gzip_file)
+
+    def read_range(self, start, end):
+        """Return the uncompressed bytes from start up to end."""
+        stream = MemberStream(self.gzip_file, self.index, start)
+        data = stream.read(end - start)
+        stream.close()
+        return data
+
+    def read_lines(self, first, last):
+        """Return lines first up to last as a list of unicode strings, without
+        the line breaks. Lines are split with splitlines(), like in
+        create_index()."""
+        last = min(last, len(self.index.lines))
+        if first >= last:
+            return []
+        start, end = self.index.line_range(first, last)
+        return self.read_range(start, end).decode('utf-8').splitlines()[:last - first]
+
+    def read_sentences(self, first, last):
+        """Return a list of (section, line) pairs for sentences first up to
+        last, where the line is a unicode string."""
+        last = min(last, len(self.index.sentences))
+        if first >= last:
+            return []
+        line_numbers = self.index.sentences[first:last]
+        lines = self.read_lines(line_numbers[0], line_numbers[-1] + 1)
+        result = []
+        for n, line_number in enumerate(line_numbers):
+            section = self.index.section_of_sentence(first + n)
+            result.append((section, lines[line_number - line_numbers[0]]))
+        return result
+
+
+
+if __name__ == '__main__':
+
+    # usage: python gzindex.py [--rewrite] GZIP_FILE...
+    # creates indexes for the files, rewriting them in blocks if requested
+    args = sys.argv[1:]
+    rewrite = '--rewrite' in args
+    for fname in [a for a in args if a != '--rewrite']:
+        index = make_seekable(fname) if rewrite else create_index(fname)
+        print fname, index
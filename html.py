@@ -27,6 +27,7 @@ Typically, you will use one of the convenience functions on HtmlDocument:
    add_text
    add_link
    add_table
+   add_data_table
 
 All these methods add elements sequentially to the body tag, the only excdption
 is the add_styles() method, which always adds to a styes list on the head
@@ -47,6 +48,23 @@ A few more examples:
    table.add_row(('right', '1'), ('computer program',), ('0.67',), ('right', '16'))
    table.add_row(('right', '2'), ('computer system',), ('0.83',), ('right', '12'))
 
+For tables with many rows, add_data_table() returns an HtmlDataTable, which does
+not create markup for each cell. The rows are written as a compact array of
+tab-separated strings, either in the html file or in a separate javascript file,
+and a small script renders only the rows that are visible and allows sorting by
+clicking a column header and filtering on a string:
+
+   table = doc.add_data_table(('term',), ('right', 'documents'),
+                              data_file='terms-data.js')
+   table.add_row('computer program', 16)
+   table.add_row('computer system', 12)
+   table.close()
+
+When the table has a data_file, rows are written to it as they are added, so
+they are not kept in memory, and close() must be called when all rows were
+added. The data file is a script rather than plain json or tsv so that it can
+be loaded from the local disk. Columns with right alignment sort numerically.
+
 
 SOME THINGS ON THE WISHLIST:
 - allow writing arbitrary stuff to the head element
@@ -56,6 +74,8 @@ SOME THINGS ON THE WISHLIST:
 
 """
 
+import os, json
+
 
 class HtmlElement(object):
     """This class, and its add() method, can take care of pretty much anything
@@ -123,6 +143,15 @@ class HtmlDocument(HtmlElement):
         self.children.append(table)
         return table
 
+    def add_data_table(self, *columns, **kwargs):
+        """Initialize an HtmlDataTable with columns, which are given in the same
+        way as cells for HtmlTable.add_row(), that is, as a tuple with a name
+        or with an alignment and a name. Keyword arguments are handed to the
+        HtmlDataTable. The table is added to the body element and returned."""
+        table = HtmlDataTable(columns, **kwargs)
+        self.children.append(table)
+        return table
+
     def add_list(self, list_type, items):
         # list_type is 'ol' or 'ul'
         l = doc.add(HtmlElement(doc, list_type))
@@ -147,13 +176,13 @@ class HtmlDocument(HtmlElement):
         fh.write("<html>\n\n<head>\n")
         title = fh.name if self.title is None else self.title
         fh.write("<title>%s</title>\n" % title)
-        self._print_styles()
+        self._print_styles(fh)
         fh.write("</head>\n\n<body>\n")
         for element in self.children:
             element.print_html(fh)
         fh.write("</body>\n\n</html>\n")
 
-    def _print_styles(self):
+    def _print_styles(self, fh):
         """Print the style sheet to the file handle."""
         # should probably have an HtmlStyleSheet class for this
         if self.styles:
@@ -226,6 +255,178 @@ class HtmlTable(HtmlElement):
         self.children.append(tr)
 
 
+_DATA_TABLE_STYLE = """<style>
+.datatable .dt-view { position: relative; overflow-y: auto; border: 1px solid #aaa; }
+.datatable table { width: 100%%; table-layout: fixed; border-collapse: collapse; }
+.datatable .dt-rows { position: absolute; left: 0; }
+.datatable th { cursor: pointer; background: #ddd; text-align: left; padding: 0 4px; }
+.datatable td { height: %dpx; padding: 0 4px; white-space: nowrap;
+                overflow: hidden; text-overflow: ellipsis; }
+.datatable tr.odd td { background: #f4f4f4; }
+.datatable .dt-info { margin-left: 10pt; color: #666; }
+</style>"""
+
+_DATA_TABLE_SCRIPT = """<script>
+if (!window.HtmlDataTable) {
+window.HtmlDataTable = function (id, columns, lines, rowHeight) {
+  var root = document.getElementById(id);
+  var view = root.querySelector('.dt-view');
+  var table = root.querySelector('.dt-rows');
+  var body = table.tBodies[0];
+  var info = root.querySelector('.dt-info');
+  var rows = lines.map(function (line) { return line.split('\\t'); });
+  var lowered = null, shown = rows, sortColumn = -1, descending = false, timer = null;
+  var maxHeight = 10000000;
+  root.querySelector('.dt-spacer').style.height = '0px';
+  function compare(i) {
+    var numeric = columns[i][0] == 'right';
+    return function (a, b) {
+      var x = numeric ? parseFloat(a[i]) : a[i], y = numeric ? parseFloat(b[i]) : b[i];
+      var c = x < y ? -1 : (x > y ? 1 : 0);
+      return descending ? -c : c; }; }
+  function render() {
+    var visible = Math.ceil(view.clientHeight / rowHeight) + 1;
+    var height = Math.min(shown.length * rowHeight, maxHeight);
+    var first, top;
+    if (height < shown.length * rowHeight) {
+      // browsers cap the height of elements, so beyond maxHeight the scroll
+      // position is mapped onto the rows in proportion
+      var fraction = Math.min(1, view.scrollTop / Math.max(1, height - view.clientHeight));
+      first = Math.floor(fraction * Math.max(0, shown.length - visible + 1));
+      top = Math.min(view.scrollTop, height - Math.min(shown.length - first, visible) * rowHeight);
+    } else {
+      first = Math.floor(view.scrollTop / rowHeight);
+      top = first * rowHeight; }
+    var last = Math.min(shown.length, first + visible);
+    root.querySelector('.dt-spacer').style.height = height + 'px';
+    while (body.firstChild) body.removeChild(body.firstChild);
+    for (var i = first; i < last; i++) {
+      var tr = body.insertRow(-1);
+      tr.className = i % 2 ? 'odd' : 'even';
+      for (var j = 0; j < columns.length; j++) {
+        var td = tr.insertCell(-1);
+        td.align = columns[j][0];
+        td.textContent = shown[i][j] === undefined ? '' : shown[i][j];
+        td.title = td.textContent; } }
+    table.style.top = Math.max(0, top) + 'px';
+    info.textContent = shown.length + ' of ' + rows.length + ' rows'; }
+  function update() {
+    var query = root.querySelector('.dt-filter').value.toLowerCase();
+    if (query) {
+      if (lowered === null) lowered = lines.map(function (l) { return l.toLowerCase(); });
+      shown = rows.filter(function (row, i) { return lowered[i].indexOf(query) >= 0; });
+    } else { shown = rows.slice(); }
+    if (sortColumn >= 0) shown.sort(compare(sortColumn));
+    view.scrollTop = 0;
+    render(); }
+  var headers = root.querySelectorAll('th');
+  for (var i = 0; i < headers.length; i++) {
+    headers[i].onclick = (function (i) { return function () {
+      descending = sortColumn == i ? !descending : false;
+      sortColumn = i;
+      update(); }; })(i); }
+  root.querySelector('.dt-filter').oninput = function () {
+    clearTimeout(timer);
+    timer = setTimeout(update, 250); };
+  view.onscroll = render;
+  update(); };
+  window.HtmlDataTableData = window.HtmlDataTableData || {};
+}
+</script>"""
+
+
+class HtmlDataTable(HtmlElement):
+
+    """A table whose rows are rendered by a script, see the module docstring.
+    The columns are tuples with a name or with an alignment and a name. Rows
+    are stored as strings with tab-separated values, tabs and newlines in
+    values are replaced by spaces. Values are shown as text, so unlike with
+    HtmlTable they cannot contain html. If data_file is given, rows are written
+    to that file, which is loaded from data_url, by default the basename of
+    data_file, so the data file should be in the same directory as the html
+    file. The view shows height pixels of rows of row_height pixels each."""
+
+    count = 0
+
+    def __init__(self, columns, data_file=None, data_url=None, height=600,
+                 row_height=20, table_id=None, class_name=None):
+        HtmlDataTable.count += 1
+        self.tag = 'div'
+        self.class_name = 'datatable' if class_name is None else 'datatable ' + class_name
+        self.attrs = {}
+        self.children = []
+        self.columns = [('left', c[0]) if len(c) == 1 else tuple(c) for c in columns]
+        self.table_id = "datatable-%d" % HtmlDataTable.count if table_id is None else table_id
+        self.height = height
+        self.row_height = row_height
+        self.data_file = data_file
+        self.data_url = data_url
+        self.rows = []
+        self.row_count = 0
+        self.data_fh = None
+        if data_file is not None:
+            if self.data_url is None:
+                self.data_url = os.path.basename(data_file)
+            self.data_fh = open(data_file, 'w')
+            self.data_fh.write("window.HtmlDataTableData = window.HtmlDataTableData || {};\n")
+            self.data_fh.write("HtmlDataTableData[%s] = [\n" % json.dumps(self.table_id))
+
+    def __str__(self):
+        return "<HtmlDataTable %s rows=%d>" % (self.table_id, self.row_count)
+
+    def add_row(self, *values):
+        line = u"\t".join([_table_value(v) for v in values])
+        self.row_count += 1
+        if self.data_fh is None:
+            self.rows.append(line)
+        else:
+            self.data_fh.write(_script_string(line) + ",\n")
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.add_row(*row)
+
+    def close(self):
+        """Finish the data file, if there is one."""
+        if self.data_fh is not None:
+            self.data_fh.write("];\n")
+            self.data_fh.close()
+            self.data_fh = None
+
+    def print_html(self, fh, indent=''):
+        fh.write("%s%s\n" % (indent, _DATA_TABLE_STYLE % self.row_height))
+        fh.write("%s<div id='%s' class='%s'>\n" % (indent, self.table_id, self.class_name))
+        fh.write("%s<p>filter: <input class='dt-filter'/><span class='dt-info'></span></p>\n" % indent)
+        fh.write("%s<table><thead><tr>" % indent)
+        for align, name in self.columns:
+            fh.write("<th>%s</th>" % name)
+        fh.write("</tr></thead></table>\n")
+        fh.write("%s<div class='dt-view' style='height: %dpx'>" % (indent, self.height))
+        fh.write("<div class='dt-spacer'></div><table class='dt-rows'><tbody></tbody></table>")
+        fh.write("</div>\n%s</div>\n" % indent)
+        fh.write("%s\n" % _DATA_TABLE_SCRIPT)
+        table_id = json.dumps(self.table_id)
+        if self.data_url is not None:
+            fh.write("<script src='%s'></script>\n" % self.data_url)
+        else:
+            fh.write("<script>\nHtmlDataTableData[%s] = [\n" % table_id)
+            for line in self.rows:
+                fh.write(_script_string(line) + ",\n")
+            fh.write("];\n</script>\n")
+        fh.write("<script>HtmlDataTable(%s, %s, HtmlDataTableData[%s], %d);</script>\n"
+                 % (table_id, json.dumps(self.columns), table_id, self.row_height))
+
+
+def _table_value(value):
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return value.replace(u"\t", u" ").replace(u"\n", u" ")
+
+def _script_string(text):
+    # the escaped slash makes sure that the string never closes a script tag
+    return json.dumps(text).replace('</', '<\\/')
+
+
 
 if __name__ == '__main__':
 
@@ -254,4 +455,10 @@ if __name__ == '__main__':
     table.add_row(('right', '1'), ('computer program',), ('0.67',), ('right', '16'), ('right', '324'))
     table.add_row(('right', '2'), ('computer system',), ('0.83',), ('right', '12'), ('right', '215'))
 
+    doc.add_paragraph(None, "and a data table with ten thousand rows")
+    table = doc.add_data_table(('term',), ('right', 't_score'), ('right', 'documents'),
+                               height=300)
+    for i in range(10000):
+        table.add_row("term %d" % i, "%.2f" % ((i * 7919 % 100) / 100.0), i * 31 % 1000)
+
     doc.print_html(fh)
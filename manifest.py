@@ -0,0 +1,114 @@
+"""
+
+Manifest of processed files for a dataset.
+
+A DataSet only records how many files were processed, so after a change to the
+pipeline configuration or after adding files to the file list, all files would
+be processed again. The Manifest records for each processed file a digest of
+its input and a fingerprint of the pipeline that created it, so that a stage
+can skip files for which neither changed:
+
+   manifest = Manifest(output_dataset)
+   for fspec, digest in manifest.changed(fspecs, input_dataset):
+       process(fspec)
+       manifest.record(fspec.target, digest)
+
+The input of a file is the file with the same target in input_dataset, or the
+source file of the FileSpec if there is no input dataset, which is the case for
+the first stage, FileSpecs without a source use the target instead. The digest
+is taken over the uncompressed content. The fingerprint is a digest of the
+pipeline trace and head of the stage, as given by
+pipeline_component_as_string(). Files whose output does not exist anymore are
+always processed again.
+
+The manifest is stored in state/manifest.txt with one line for each file,
+containing the target, the input digest and the pipeline fingerprint. Lines are
+appended as files are recorded and later lines overrule earlier ones. Use
+compact() to rewrite the file without the overruled lines.
+
+"""
+
+import os, hashlib
+
+from path import read_input_data, file_exists
+from compression import get_codec
+from batch import pipeline_component_as_string
+
+
+def pipeline_fingerprint(dataset):
+    """Return a digest of the pipeline that creates the dataset. If the dataset
+    is used in a processing stage, the pipeline is taken from the global
+    configuration, otherwise from the pipeline files of the dataset."""
+    if dataset.stage_name is not None:
+        trace, head = dataset.split_pipeline()
+    else:
+        trace, head = dataset.pipeline_trace, dataset.pipeline_head
+    pipeline_string = pipeline_component_as_string(trace + [head])
+    return hashlib.md5(pipeline_string).hexdigest()
+
+def input_digest(filename):
+    """Return a digest of the uncompressed content of filename, or None if the
+    file does not exist."""
+    data, codec = read_input_data(filename)
+    if data is None:
+        return None
+    if codec != 'raw':
+        data = get_codec(codec).decompress(data)
+    return hashlib.md5(data).hexdigest()
+
+
+class Manifest(object):
+
+    """The manifest of a dataset, with entries for all targets that were
+    recorded. The fingerprint is the fingerprint of the current pipeline."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.filename = os.path.join(dataset.path, 'state', 'manifest.txt')
+        self.fingerprint = pipeline_fingerprint(dataset)
+        self.entries = {}
+        if os.path.exists(self.filename):
+            for line in open(self.filename):
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 3:
+                    self.entries[fields[0]] = (fields[1], fields[2])
+
+    def __str__(self):
+        return "<Manifest %s entries=%d>" % (self.filename, len(self.entries))
+
+    def is_current(self, target, digest):
+        """Return True if target was created from input with the given digest
+        by the current pipeline and the output still exists."""
+        if self.entries.get(target) != (digest, self.fingerprint):
+            return False
+        return file_exists(os.path.join(self.dataset.path, 'files', target))
+
+    def changed(self, fspecs, input_dataset=None):
+        """Generate pairs of FileSpec and input digest for all fspecs that need
+        to be processed."""
+        for fspec in fspecs:
+            if input_dataset is not None:
+                input_file = os.path.join(input_dataset.path, 'files', fspec.target)
+            else:
+                input_file = fspec.source if fspec.source is not None else fspec.target
+            digest = input_digest(input_file)
+            if digest is None or not self.is_current(fspec.target, digest):
+                yield fspec, digest
+
+    def record(self, target, digest):
+        """Record that target was created from input with digest by the current
+        pipeline."""
+        self.entries[target] = (digest, self.fingerprint)
+        fh = open(self.filename, 'a')
+        fh.write("%s\t%s\t%s\n" % (target, digest, self.fingerprint))
+        fh.close()
+
+    def compact(self):
+        """Rewrite the manifest with only the latest entry for each target."""
+        tmp_file = self.filename + '.tmp'
+        fh = open(tmp_file, 'w')
+        for target in sorted(self.entries):
+            digest, fingerprint = self.entries[target]
+            fh.write("%s\t%s\t%s\n" % (target, digest, fingerprint))
+        fh.close()
+        os.rename(tmp_file, self.filename)
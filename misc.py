@@ -4,6 +4,15 @@ Miscellaneous utilities.
 
 """
 
+from array import array
+from bisect import bisect_right
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def findall(haystack, needle, idx=0):
     """Finds the beginning offset of all occurrences of needle in haystack and
@@ -16,30 +25,218 @@ def findall(haystack, needle, idx=0):
             idx += 1
     return offsets
 
+def shards(items, shard_size):
+    """Generate lists of shard_size consecutive elements from the iterable
+    items, the last list can be shorter."""
+    shard = []
+    for item in items:
+        shard.append(item)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+class MultiMatcher(object):
+
+    """Finds all occurrences of a list of terms in one pass over a string,
+    using the Aho-Corasick algorithm. Build the matcher once and then use it
+    on as many strings as needed:
+
+       matcher = MultiMatcher(['computer', 'computer program', 'program'])
+       matcher.findall('a computer program')
+       ==> [(2, 'computer'), (2, 'computer program'), (11, 'program')]
+
+    The findall() method returns (offset, term) pairs sorted on offset and,
+    for matches at the same offset, on term length."""
+
+    def __init__(self, terms):
+        self.terms = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for term in terms:
+            if term:
+                self._add_term(term)
+        self._add_failure_links()
+
+    def __str__(self):
+        return "<MultiMatcher terms=%d states=%d>" % (len(self.terms), len(self._goto))
+
+    def _add_term(self, term):
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        if term not in self._output[state]:
+            self._output[state].append(term)
+            self.terms.append(term)
+
+    def _add_failure_links(self):
+        """Breadth-first traversal of the trie to add the failure links and to
+        add the output of the failure state to each state."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state].extend(self._output[fail])
+
+    def findall(self, haystack, overlapping=True, token_boundaries=False):
+        """Return a list of (offset, term) pairs for all terms in haystack. If
+        overlapping is False, then the leftmost longest matches are returned
+        and matches that overlap with those are dropped. If token_boundaries
+        is True, then only matches are returned that are not preceded or
+        followed by an alphanumeric character."""
+        hits = []
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for idx, char in enumerate(haystack):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for term in output[state]:
+                offset = idx - len(term) + 1
+                if token_boundaries and not _at_boundaries(haystack, offset, idx + 1):
+                    continue
+                hits.append((offset, term))
+        hits.sort(key=lambda hit: (hit[0], len(hit[1])))
+        if not overlapping:
+            hits = _remove_overlapping(hits)
+        return hits
+
+
+def _at_boundaries(haystack, start, end):
+    if start > 0 and haystack[start - 1].isalnum():
+        return False
+    if end < len(haystack) and haystack[end].isalnum():
+        return False
+    return True
+
+def _remove_overlapping(hits):
+    """Take a list of hits sorted on offset and term length and keep the longest
+    match at each offset, dropping matches that overlap with earlier ones."""
+    selected = []
+    end = 0
+    for i, (offset, term) in enumerate(hits):
+        if offset < end:
+            continue
+        if i + 1 < len(hits) and hits[i + 1][0] == offset:
+            continue
+        selected.append((offset, term))
+        end = offset + len(term)
+    return selected
+
 
 
 class BinSorter(object):
 
-    def __init__(self):
-        self.bins = {
-            0: '0.00-0.05', 1: '0.05-0.10',
-            2: '0.10-0.15', 3: '0.15-0.20',
-            4: '0.20-0.25', 5: '0.25-0.30',
-            6: '0.30-0.35', 7: '0.35-0.40',
-            8: '0.40-0.45', 9: '0.45-0.50',
-            10: '0.50-0.55', 11: '0.55-0.60',
-            12: '0.60-0.65', 13: '0.65-0.70',
-            14: '0.70-0.75', 15: '0.75-0.80',
-            16: '0.80-0.85', 17: '0.85-0.90',
-            18: '0.90-0.95', 19: '0.95-1.00' }
-        self.number_of_bins = len(self.bins)
+    """Sorts scores into bins. By default there are 20 bins of equal width from
+    0.0 to 1.0, but another number of bins or a list of bin edges can be
+    given. Bin i contains the scores from edges[i] up to edges[i+1], except for
+    the last bin, which also contains the scores equal to the last edge. Scores
+    outside of the edges are put in the first or last bin.
+
+    The find_bin() method prints the bin for one score. The sort() method bins
+    a whole sequence of scores and returns counts for all bins and, if
+    requested, the indexes of the scores in each bin. NumPy is used if it is
+    available. The sort_file() method does the same for a file with scores
+    without reading the entire file into memory."""
+
+    def __init__(self, number_of_bins=20, edges=None, use_numpy=True):
+        if edges is None:
+            edges = [float(i) / number_of_bins for i in range(number_of_bins + 1)]
+        self.edges = list(edges)
+        self.number_of_bins = len(self.edges) - 1
+        self.bins = {}
+        for i in range(self.number_of_bins):
+            self.bins[i] = "%.2f-%.2f" % (self.edges[i], self.edges[i+1])
+        self.use_numpy = use_numpy and numpy is not None
+
+    def bin_index(self, score):
+        """Return the index of the bin for score."""
+        bin_for_score = bisect_right(self.edges, score) - 1
+        return min(max(bin_for_score, 0), self.number_of_bins - 1)
 
     def find_bin(self, score):
-        bin_for_score = int(score * self.number_of_bins)
-        if bin_for_score == self.number_of_bins:
-            bin_for_score = bin_for_score - 1
+        bin_for_score = self.bin_index(score)
         print "%2d  %s  %f  %s" % (bin_for_score, self.bins[bin_for_score], score, score)
 
+    def sort(self, scores, members=False):
+        """Sort a sequence of scores into the bins and return a pair of counts
+        and members. Counts is a list with the number of scores in each bin.
+        If members is True, then the second element is a list with for each bin
+        an array('l') with the indexes of the scores in that bin, otherwise it
+        is None. The same types are returned with and without NumPy."""
+        return self._sort(scores, members, 0)
+
+    def _sort(self, scores, members, offset):
+        # indexes in membership start at offset
+        if self.use_numpy:
+            return self._sort_with_numpy(scores, members, offset)
+        counts = [0] * self.number_of_bins
+        membership = [array('l') for i in range(self.number_of_bins)] if members else None
+        for i, score in enumerate(scores, offset):
+            bin_for_score = self.bin_index(score)
+            counts[bin_for_score] += 1
+            if members:
+                membership[bin_for_score].append(i)
+        return counts, membership
+
+    def _sort_with_numpy(self, scores, members, offset):
+        scores = numpy.asarray(scores, dtype=float)
+        bins = numpy.searchsorted(self.edges, scores, side='right') - 1
+        bins = numpy.clip(bins, 0, self.number_of_bins - 1)
+        counts = numpy.bincount(bins, minlength=self.number_of_bins).tolist()
+        membership = None
+        if members:
+            order = numpy.argsort(bins, kind='mergesort')
+            boundaries = numpy.cumsum(counts)[:-1]
+            membership = [array('l', (part + offset).astype('l').tobytes())
+                          for part in numpy.split(order, boundaries)]
+        return counts, membership
+
+    def sort_file(self, filename, column=-1, members=False, chunk_size=100000):
+        """Sort the scores in a file into bins, where the scores are taken from
+        a column in a tab-separated file. The file is read in chunks of
+        chunk_size lines. Returns counts and members like sort(), except that
+        members are line numbers instead of indexes. Line numbers are added to
+        the arrays of the bins chunk by chunk."""
+        counts = [0] * self.number_of_bins
+        membership = [array('l') for i in range(self.number_of_bins)] if members else None
+        offset = 0
+        chunk = []
+        with open(filename) as fh:
+            for line in fh:
+                chunk.append(float(line.rstrip("\n").split("\t")[column]))
+                if len(chunk) == chunk_size:
+                    self._add_chunk(chunk, offset, counts, membership)
+                    offset += len(chunk)
+                    chunk = []
+        self._add_chunk(chunk, offset, counts, membership)
+        return counts, membership
+
+    def _add_chunk(self, chunk, offset, counts, membership):
+        chunk_counts, chunk_membership = self._sort(chunk, membership is not None, offset)
+        for i in range(self.number_of_bins):
+            counts[i] += chunk_counts[i]
+            if membership is not None:
+                membership[i].extend(chunk_membership[i])
+
     def test(self):
         scores = [0.00000, 1.3375632947763128E-4, 1.3375632947763128E-7,
                   0.143, 0.34,
@@ -47,6 +244,7 @@ class BinSorter(object):
                   0.999999, 1.00000, 1]
         for score in scores:
             self.find_bin(score)
+        print self.sort(scores)[0]
 
 
 
@@ -0,0 +1,265 @@
+"""
+
+Packed storage for datasets.
+
+By default, a dataset stores each document in its own file under the files
+directory of the dataset. With millions of documents, this puts a heavy load on
+the file system. A dataset can instead use packed storage, where all documents
+are appended to a few large shard files in the packed directory of the dataset:
+
+   data/d2_tag/01/packed/shard-20140312101501-node1-1234.dat
+   data/d2_tag/01/packed/shard-20140312101501-node1-1234.idx
+
+Each process that writes to a dataset creates its own shard, so processes on
+different machines can write to the same dataset without locking. The index
+file next to the shard has one line for each document, with the target path of
+the document (the target from the FileSpec), the offset and length of the
+document in the shard, and a codec, which is the name of a codec from
+compression.py, for example 'gz' for gzip-compressed data, or 'raw' for
+uncompressed data. If a target occurs more than once, then the
+most recent shard wins.
+
+Client code does not usually use this module directly. The functions
+open_input_file() and open_output_file() in path.py check whether a filename
+is in a dataset with packed storage and if so read from or write to the shard
+files. A dataset uses packed storage if it has a packed directory, which is
+created by DataSet.initialize_on_disk() if the general configuration of the
+corpus has the setting storage=packed.
+
+Existing datasets can be converted with pack_files(), which keeps the original
+files in place and does not decompress compressed files.
+
+"""
+
+import os, sys, time, socket, glob, threading
+from io import BytesIO
+
+from compression import CODECS, get_codec, codec_for_filename
+
+
+PACKED_DIR = 'packed'
+
+# maps the paths of datasets to PackedStore instances, or to None for datasets
+# that do not use packed storage
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_packed_store(dataset_path):
+    """Return the PackedStore for the dataset in dataset_path, or None if the
+    dataset does not use packed storage. The result is cached so the file
+    system is only checked once for each dataset."""
+    with _stores_lock:
+        if dataset_path not in _stores:
+            if os.path.isdir(os.path.join(dataset_path, PACKED_DIR)):
+                _stores[dataset_path] = PackedStore(dataset_path)
+            else:
+                _stores[dataset_path] = None
+        return _stores[dataset_path]
+
+def create_packed_store(dataset_path):
+    """Create the packed directory for a dataset and return the store."""
+    packed_dir = os.path.join(dataset_path, PACKED_DIR)
+    if not os.path.isdir(packed_dir):
+        os.makedirs(packed_dir)
+    with _stores_lock:
+        _stores.pop(dataset_path, None)
+    return get_packed_store(dataset_path)
+
+def split_filename(filename):
+    """Split a filename like data/d2_tag/01/files/2000/US1A.xml into the path of
+    the dataset and the target path of the document. Returns (None, None) if
+    the filename is not inside the files directory of a dataset. The
+    extension of a compression codec, like .gz, is removed from the target."""
+    marker = os.sep + 'files' + os.sep
+    idx = filename.rfind(marker)
+    if idx < 0:
+        return None, None
+    target = filename[idx + len(marker):]
+    codec = codec_for_filename(target)
+    if codec is not None:
+        target = target[:-len(codec.extension)]
+    return filename[:idx], target
+
+def lookup(filename):
+    """Return a pair of PackedStore and target for filename, or a pair of Nones
+    if filename is not in a dataset with packed storage."""
+    dataset_path, target = split_filename(filename)
+    if dataset_path is None:
+        return None, None
+    store = get_packed_store(dataset_path)
+    if store is None:
+        return None, None
+    return store, target
+
+def pack_files(dataset_path, targets, verbose=False):
+    """Add the files for all targets in the files directory of the dataset to
+    the packed store of the dataset, creating the store if needed. Compressed
+    files are added without decompressing them. Returns the number of files
+    added."""
+    store = create_packed_store(dataset_path)
+    count = 0
+    for target in targets:
+        fname = os.path.join(dataset_path, 'files', target)
+        for codec in CODECS:
+            if os.path.exists(fname + codec.extension):
+                store.add(target, open(fname + codec.extension, 'rb').read(), codec.name)
+                break
+        else:
+            if os.path.exists(fname):
+                store.add(target, open(fname, 'rb').read(), 'raw')
+            else:
+                if verbose:
+                    print "[pack_files] file does not exist: %s" % fname
+                continue
+        count += 1
+    store.close()
+    return count
+
+
+class PackedStore(object):
+
+    """Gives access to the shards in the packed directory of a dataset. The
+    index of all shards is read when it is first needed. Documents written by
+    this store are added to the in-memory index, documents written by other
+    processes become visible after calling refresh(). A store can be shared by
+    threads, a lock protects the index and the shared file handles."""
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.dir = os.path.join(dataset_path, PACKED_DIR)
+        self.index = None
+        self._readers = {}
+        self._shard = None
+        self._shard_fh = None
+        self._index_fh = None
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        count = 'unread' if self.index is None else len(self.index)
+        return "<PackedStore %s documents=%s>" % (self.dir, count)
+
+    def refresh(self):
+        """Read the index files of all shards. The new index replaces the old
+        one when it is complete."""
+        index = {}
+        for index_file in sorted(glob.glob(os.path.join(self.dir, 'shard-*.idx'))):
+            shard = os.path.basename(index_file)[:-4] + '.dat'
+            for line in open(index_file):
+                fields = line.rstrip("\n").split("\t")
+                # skip lines that were partially written by a crashed process
+                if len(fields) != 4:
+                    continue
+                target, offset, length, codec = fields
+                index[target] = (shard, int(offset), int(length), codec)
+        with self._lock:
+            self.index = index
+
+    def _get_index(self):
+        with self._lock:
+            if self.index is None:
+                self.refresh()
+            return self.index
+
+    def has(self, target):
+        return target in self._get_index()
+
+    def targets(self):
+        return self._get_index().keys()
+
+    def size(self, target):
+        """Return the size of the stored, possibly compressed, data for
+        target."""
+        return self._get_index()[target][2]
+
+    def codec(self, target):
+        return self._get_index()[target][3]
+
+    def read(self, target):
+        """Return the uncompressed content for target as a byte string."""
+        data, codec = self.read_stored(target)
+        if codec != 'raw':
+            data = get_codec(codec).decompress(data)
+        return data
+
+    def read_stored(self, target):
+        """Return a pair of the data as stored for target and its codec."""
+        shard, offset, length, codec = self._get_index()[target]
+        with self._lock:
+            fh = self._readers.get(shard)
+            if fh is None:
+                fh = open(os.path.join(self.dir, shard), 'rb')
+                self._readers[shard] = fh
+            fh.seek(offset)
+            return fh.read(length), codec
+
+    def add(self, target, data, codec='raw'):
+        """Append data for target to the shard of this process. The codec
+        describes how data was stored, use 'raw' for uncompressed data and the
+        name of the codec for compressed data."""
+        index = self._get_index()
+        with self._lock:
+            if self._shard_fh is None:
+                self._open_shard()
+            self._shard_fh.seek(0, os.SEEK_END)
+            offset = self._shard_fh.tell()
+            self._shard_fh.write(data)
+            self._shard_fh.flush()
+            self._index_fh.write("%s\t%d\t%d\t%s\n" % (target, offset, len(data), codec))
+            self._index_fh.flush()
+            index[target] = (self._shard, offset, len(data), codec)
+
+    def add_compressed(self, target, data, codec='gz', level=None):
+        """Compress data with the named codec and append it for target."""
+        self.add(target, get_codec(codec).compress(data, level), codec)
+
+    def _open_shard(self):
+        name = "shard-%s-%s-%d" % (time.strftime("%Y%m%d%H%M%S"),
+                                   socket.gethostname(), os.getpid())
+        self._shard = name + '.dat'
+        self._shard_fh = open(os.path.join(self.dir, name + '.dat'), 'ab')
+        self._index_fh = open(os.path.join(self.dir, name + '.idx'), 'a')
+
+    def close(self):
+        with self._lock:
+            for fh in self._readers.values():
+                fh.close()
+            self._readers = {}
+            if self._shard_fh is not None:
+                self._shard_fh.close()
+                self._index_fh.close()
+                self._shard = self._shard_fh = self._index_fh = None
+
+
+class PackedOutputBuffer(BytesIO):
+
+    """Buffer for a document that is written to a packed store when the buffer
+    is closed. The data are compressed with the named codec and level, unless
+    codec is 'raw'."""
+
+    def __init__(self, store, target, codec='gz', level=None):
+        BytesIO.__init__(self)
+        self.store = store
+        self.target = target
+        self.codec = codec
+        self.level = level
+
+    def close(self):
+        if not self.closed:
+            if self.codec != 'raw':
+                self.store.add_compressed(self.target, self.getvalue(), self.codec, self.level)
+            else:
+                self.store.add(self.target, self.getvalue(), 'raw')
+        BytesIO.close(self)
+
+
+
+if __name__ == '__main__':
+
+    # usage: python packed.py DATASET_PATH FILELIST
+    # packs all files from FILELIST that are in the dataset
+    from path import FileSpec
+    dataset_path, filelist = sys.argv[1:3]
+    targets = [FileSpec(line).target for line in open(filelist)
+               if line.strip() and not line.startswith('#')]
+    print "Packed %d files" % pack_files(dataset_path, targets, verbose=True)
@@ -1,4 +1,18 @@
 import os, sys, errno, stat, subprocess, gzip, codecs
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from io import BytesIO
+
+from packed import lookup, split_filename, PackedOutputBuffer
+from compression import CODECS, DEFAULT_CODEC, MAGIC_SIZE, get_codec, codec_for_filename, detect_codec
+from pgzip import ParallelGzipWriter
+from gzindex import GzipIndex, IndexedGzipFile, MemberStream
+
+
+# maps the paths of datasets to pairs of Codec and compression level, see
+# dataset_codec()
+_dataset_codecs = {}
 
 
 def read_only(filename):
@@ -9,36 +23,244 @@ def make_writable(filename):
     """Make filename writable by owner."""
     os.chmod(filename, stat.S_IWRITE | stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
 
-def open_input_file(filename):
-    """First checks whether there is a gzipped version of filename, if so, it
-    returns a StreamReader instance. Otherwise, filename is a regular
-    uncompressed file and a file object is returned."""
-    # TODO: generalize this over reading and writing (or create two methods)
-    #print "[file.py in open_input_file] filename: %s" % filename
-    if os.path.exists(filename + '.gz'):
-        #print "file.py: in if, filename: %s" % (filename + '.gz')
-        gzipfile = gzip.open(filename + '.gz', 'rb')
-        reader = codecs.getreader('utf-8')
-        return reader(gzipfile)
-    elif os.path.exists(filename):
+def open_input_file(filename, offset=None):
+    """First checks whether filename is in a dataset with packed storage, if so,
+    it returns a StreamReader on the content from the packed store. Then checks
+    whether there is a compressed version of filename, with the extension of
+    one of the codecs in compression.py, if so, it returns a StreamReader
+    instance. Otherwise, filename is opened as it is, and decompressed if it
+    starts with the magic bytes of a codec and can be decompressed. If offset
+    is given, the stream starts at that uncompressed byte offset, which is
+    fast for gzipped files that have a seek index (see gzindex.py)."""
+    reader = codecs.getreader('utf-8')
+    store, target = lookup(filename)
+    if store is not None and store.has(target):
+        stream = BytesIO(store.read(target))
+        if offset is not None:
+            stream.seek(offset)
+        return reader(stream)
+    if offset is not None:
+        index = GzipIndex.load(filename + '.gz')
+        if index is not None:
+            return reader(MemberStream(filename + '.gz', index, offset))
+    for codec in _probe_order(filename):
+        try:
+            fh = codec.open(filename + codec.extension, 'rb')
+        except (IOError, OSError):
+            continue
+        if offset is not None:
+            fh.seek(offset)
+        return reader(fh)
+    try:
         # fallback case, possibly needed for older runs
-        return codecs.open(filename, encoding='utf-8')
-    else: 
+        fh = open(filename, 'rb')
+    except IOError:
         print "[file.py open_input_file] file does not exist: %s" % filename
-        
-def open_output_file(fname, compress=True):
-    """Return a StreamWriter instance on the gzip file object if compress is
-    True, otherwise return a file object."""
+        return None
+    codec = codec_for_filename(filename) or _detect_file_codec(filename, fh.read(MAGIC_SIZE))
+    fh.seek(0)
+    if codec is not None:
+        fh.close()
+        fh = codec.open(filename, 'rb')
+    if offset is not None:
+        fh.seek(offset)
+    return reader(fh)
+
+def read_tag_file(tag_file, keep_tags=True):
+    """Read a tag file and return a pair of a list of Sentences and a list of
+    sections, where each section is a pair of the section name and the number
+    of its first sentence. The file is read as a whole and then split into
+    lines, which is much faster than iterating over the lines of the
+    StreamReader. Lines are split with splitlines(), which breaks lines where
+    the StreamReader does, including at characters like u'\x85' and u'\u2028',
+    so sentence numbers do not change. Tags are kept in the Sentences if
+    keep_tags is True."""
+    fh = open_input_file(tag_file)
+    lines = fh.read().splitlines()
+    fh.close()
+    sentences = []
+    sections = []
+    section = None
+    for line in lines:
+        if line.startswith(u'FH_'):
+            section = line.strip()
+            sections.append((section, len(sentences)))
+        else:
+            tokens, tags = parse_tag_line(line, keep_tags)
+            sentences.append(Sentence(section, tokens, tags))
+    return sentences, sections
+
+def read_sentences(tag_file, first, last):
+    """Return a list of Sentences for sentences first up to last of tag_file,
+    counting the lines that are not section headers. Only the needed part of
+    the file is decompressed if the gzipped tag file has a seek index."""
+    index = GzipIndex.load(tag_file + '.gz')
+    if index is not None:
+        lines = IndexedGzipFile(tag_file + '.gz', index).read_sentences(first, last)
+        return [Sentence(section, *parse_tag_line(line)) for section, line in lines]
+    return read_tag_file(tag_file)[0][first:last]
+
+
+class TagSet(dict):
+
+    """Maps POS tags to small integers, adding tags when they are first looked
+    up. The names list maps integers back to tags."""
+
+    def __init__(self):
+        dict.__init__(self)
+        self.names = []
+
+    def __missing__(self, tag):
+        self[tag] = len(self.names)
+        self.names.append(tag)
+        return self[tag]
+
+TAGSET = TagSet()
+
+_first = itemgetter(0)
+_last = itemgetter(2)
+
+def parse_tag_line(line, keep_tags=True):
+    """Return the tokens of a line from a tag file as a tuple and the tags as
+    an array of TAGSET identifiers, or None if keep_tags is False."""
+    parts = [t.rpartition(u'_') for t in line.rstrip().split(u' ')]
+    tokens = tuple(map(_first, parts))
+    if not keep_tags:
+        return tokens, None
+    return tokens, array('I', map(TAGSET.__getitem__, map(_last, parts)))
+
+def open_output_file(fname, compress=True, threads=None):
+    """Return a StreamWriter instance on a compressed file object if compress is
+    True, otherwise return a file object. The codec is taken from the extension
+    of fname if it has one, otherwise it is the codec of the dataset that fname
+    is in (see dataset_codec()) and its extension is added to fname. If fname
+    is in a dataset with packed storage, the StreamWriter writes to a buffer
+    that is added to the packed store when it is closed. For large gzipped
+    files, give a number of threads to compress with a ParallelGzipWriter."""
+    writer = codecs.getwriter('utf-8')
+    codec, level = dataset_codec(fname)
+    store, target = lookup(fname)
+    if store is not None:
+        codec_name = codec.name if compress else 'raw'
+        return writer(PackedOutputBuffer(store, target, codec_name, level))
     if compress:
-        if fname.endswith('.gz'):
-            gzipfile = gzip.open(fname, 'wb')
+        extension_codec = codec_for_filename(fname)
+        if extension_codec is None:
+            fname = fname + codec.extension
+        elif extension_codec is not codec:
+            codec, level = extension_codec, None
+        if codec.name == 'gz' and threads is not None and threads > 1:
+            compressed_file = ParallelGzipWriter(fname, level=6 if level is None else level,
+                                                 threads=threads)
         else:
-            gzipfile = gzip.open(fname + '.gz', 'wb')
-        writer = codecs.getwriter('utf-8')
-        return writer(gzipfile)
+            compressed_file = codec.open(fname, 'wb', level)
+        return writer(compressed_file)
     else:
         return codecs.open(fname, 'w', encoding='utf-8')
 
+def dataset_codec(filename):
+    """Return a pair of the Codec and the compression level for the dataset that
+    filename is in. These are read from config/compression.txt in the dataset,
+    which is written by set_dataset_compression(). The default is gzip with the
+    default level, which is also used for files that are not in a dataset. The
+    result is cached for each dataset."""
+    dataset_path = split_filename(filename)[0]
+    if dataset_path not in _dataset_codecs:
+        codec, level = get_codec(DEFAULT_CODEC), None
+        if dataset_path is not None:
+            try:
+                fields = open(os.path.join(dataset_path, 'config', 'compression.txt')).read().split()
+                codec = get_codec(fields[0])
+                level = int(fields[1]) if len(fields) > 1 else None
+            except IOError:
+                pass
+        _dataset_codecs[dataset_path] = (codec, level)
+    return _dataset_codecs[dataset_path]
+
+def set_dataset_compression(dataset_path, codec_name, level=None):
+    """Set the codec and compression level that are used for files written to
+    the dataset. Raises a ValueError if the codec is not available."""
+    get_codec(codec_name)
+    setting = codec_name if level is None else "%s %d" % (codec_name, level)
+    create_file(os.path.join(dataset_path, 'config', 'compression.txt'), setting + "\n")
+    _dataset_codecs.pop(dataset_path, None)
+
+def _probe_order(filename):
+    """Return the codecs in the order in which their extensions are tried for
+    filename, starting with the codec of its dataset."""
+    first = dataset_codec(filename)[0]
+    return [first] + [codec for codec in CODECS if codec is not first]
+
+def _detect_file_codec(filename, head):
+    """Return the codec of filename, which starts with the bytes in head, or
+    None if it is not compressed. A file that starts with the magic bytes of a
+    codec but that cannot be decompressed is taken to be uncompressed."""
+    codec = detect_codec(head)
+    if codec is None:
+        return None
+    try:
+        fh = codec.open(filename, 'rb')
+        try:
+            fh.read(1)
+        finally:
+            fh.close()
+    except Exception:
+        # the codec modules do not share an exception for bad data
+        return None
+    return codec
+
+def read_input_data(filename):
+    """Return a pair of the data in filename as it is stored and the name of the
+    codec of that data, which is 'raw' for uncompressed data. Like
+    open_input_file(), this checks for packed storage and for compressed
+    files. Returns (None, None) if there is no data for filename."""
+    store, target = lookup(filename)
+    if store is not None and store.has(target):
+        return store.read_stored(target)
+    for codec in _probe_order(filename):
+        try:
+            with open(filename + codec.extension, 'rb') as fh:
+                return fh.read(), codec.name
+        except IOError:
+            pass
+    try:
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+            codec = _detect_file_codec(filename, data[:MAGIC_SIZE])
+            return data, 'raw' if codec is None else codec.name
+    except IOError:
+        print "[file.py read_input_data] file does not exist: %s" % filename
+        return None, None
+
+def open_input_data(data, codec):
+    """Return a StreamReader on data as returned by read_input_data()."""
+    if codec == 'raw':
+        stream = BytesIO(data)
+    else:
+        stream = get_codec(codec).open_data(data)
+    reader = codecs.getreader('utf-8')
+    return reader(stream)
+
+def decode_input_data(data, codec):
+    """Return the content of data as returned by read_input_data() as a unicode
+    string."""
+    if codec != 'raw':
+        data = get_codec(codec).decompress(data)
+    return data.decode('utf-8')
+
+def file_exists(filename):
+    """Return True if filename or one of its compressed versions exist, either
+    in a dataset with packed storage or as a file."""
+    store, target = lookup(filename)
+    if store is not None and store.has(target):
+        return True
+    if os.path.exists(filename):
+        return True
+    for codec in CODECS:
+        if os.path.exists(filename + codec.extension):
+            return True
+    return False
+
 def ensure_path(path, verbose=False):
     """Make sure path exists."""
     try:
@@ -89,7 +311,8 @@ def create_file(filename, content=None):
 
 def filename_generator(path, filelist):
     """Creates generator on the filelist, yielding the concatenation of the path
-    and a path in filelist."""
+    and a path in filelist. The filenames can be handed to open_input_file() and
+    open_output_file() also when the dataset uses packed storage."""
     fh = open(filelist)
     for line in fh:
         line = line.strip()
@@ -182,12 +405,19 @@ class FileData(object):
     phr_feats file, amended with a context taken from the tags file. Each term
     is an instance of Term and contains a list of TermInstances. Each
     TermInstance provides access to the features and the context of the
-    instance."""
+    instance. The context is a Sentence from the sentences list, which is
+    shared by all instances in that sentence. The tags variable is kept as an
+    alias of the sentences list for older code. The sections list has the name
+    and first sentence of each section. POS tags are stored in the Sentences
+    unless keep_tags is False."""
 
-    def __init__(self, tag_file, feat_file, verbose=False):
+    def __init__(self, tag_file, feat_file, verbose=False, keep_tags=True):
         self.verbose = verbose
+        self.keep_tags = keep_tags
         self.tag_file = tag_file
         self.feat_file = feat_file
+        self._term_instances_dictionary = None
+        self._instance_index = None
         self._init_collect_lines_from_tag_file()
         self._init_collect_term_info_from_phrfeats_file()
         self._init_amend_term_info()
@@ -220,25 +450,30 @@ class FileData(object):
 
     def get_term_instances_dictionary(self):
         """Returns a dictionary indexed on document offsets (sentence
-        numbers). The values are lists of TermInstances."""
-        terms = {}
-        for t in self.get_terms():
-            term = self.get_term(t)
-            for inst in term.term_instances:
+        numbers). The values are lists of TermInstances, sorted on their token
+        offset. The dictionary is created from the instance index the first
+        time this method is called and the same dictionary is returned on all
+        later calls, so it should not be changed."""
+        if self._term_instances_dictionary is None:
+            terms = {}
+            for inst in self.get_instance_index().instances:
                 terms.setdefault(inst.doc_loc, []).append(inst)
-        return terms
+            self._term_instances_dictionary = terms
+        return self._term_instances_dictionary
+
+    def get_instance_index(self):
+        """Return the InstanceIndex for all term instances in the document,
+        creating it if needed."""
+        if self._instance_index is None:
+            instances = []
+            for term in self.terms.values():
+                instances.extend(term.term_instances)
+            self._instance_index = InstanceIndex(instances)
+        return self._instance_index
 
     def _init_collect_lines_from_tag_file(self):
-        self.tags = []
-        with open_input_file(self.tag_file) as fh:
-            section = None
-            for line in fh:
-                if line.startswith('FH_'):
-                    section = line.strip()
-                else:
-                    tokens = line.rstrip().split(' ')
-                    tokens = [t.rpartition('_')[0] for t in tokens]
-                    self.tags.append([section, tokens])
+        self.sentences, self.sections = read_tag_file(self.tag_file, self.keep_tags)
+        self.tags = self.sentences
 
     def _init_collect_term_info_from_phrfeats_file(self):
         self.terms = {}
@@ -256,12 +491,12 @@ class FileData(object):
         data."""
         if self.verbose:
             print "\nGathering term info from tags and feats in %s..." \
-                % os.path.basename(tag_file)
+                % os.path.basename(self.tag_file)
         for term in self.terms:
             t = Term(term)
             for term_data in self.terms[term]:
                 term_instance = TermInstance(term, term_data)
-                context = self.tags[term_instance.doc_loc]
+                context = self.sentences[term_instance.doc_loc]
                 term_instance.add_context(context)
                 t.add_instance(term_instance)
             self.terms[term] = t
@@ -277,6 +512,107 @@ class FileData(object):
             print
 
 
+class InstanceIndex(object):
+
+    """Index of the term instances in a document, sorted on sentence number and
+    then on token offset. Sentence numbers and token offsets are also stored in
+    arrays so that ranges of instances can be found by bisection. Instance
+    variables:
+
+       instances:
+          list of TermInstances in document order
+
+       doc_locs, tok1s, tok2s:
+          arrays with the sentence number, first token and token end of each
+          instance in the instances list
+    """
+
+    def __init__(self, instances):
+        self.instances = sorted(instances, key=TermInstance.sort_key)
+        self.doc_locs = array('i', [inst.doc_loc for inst in self.instances])
+        self.tok1s = array('i', [inst.tok1 for inst in self.instances])
+        self.tok2s = array('i', [inst.tok2 for inst in self.instances])
+
+    def __str__(self):
+        return "<InstanceIndex instances=%d>" % len(self.instances)
+
+    def __len__(self):
+        return len(self.instances)
+
+    def in_sentences(self, first, last):
+        """Return the instances in sentences first up to and including last, in
+        document order."""
+        i = bisect_left(self.doc_locs, first)
+        j = bisect_left(self.doc_locs, last + 1)
+        return self.instances[i:j]
+
+    def in_sentence(self, doc_loc):
+        """Return the instances in sentence doc_loc, sorted on token offset."""
+        return self.in_sentences(doc_loc, doc_loc)
+
+    def overlapping(self, doc_loc, tok1, tok2):
+        """Return the instances in sentence doc_loc that overlap with the token
+        span from tok1 up to tok2."""
+        i = bisect_left(self.doc_locs, doc_loc)
+        j = bisect_left(self.doc_locs, doc_loc + 1)
+        result = []
+        for k in range(i, j):
+            if self.tok1s[k] >= tok2:
+                break
+            if self.tok2s[k] > tok1:
+                result.append(self.instances[k])
+        return result
+
+
+class Sentence(object):
+
+    """A Sentence stores the section, the tokens and the POS tags of a line in
+    a tag file. The tags are an array of TAGSET identifiers, or None if tags
+    were not kept. The tokens are also stored as one string together with the
+    character offsets of all tokens, so that any span of tokens can be
+    retrieved with a slice instead of a join. For backward compatibility, a
+    Sentence can also be used as the [section, tokens] pair that was used
+    before."""
+
+    def __init__(self, section, tokens, tags=None):
+        self.section = section
+        self.tokens = tokens
+        self.tags = tags
+        self.length = len(tokens)
+        self.text = ' '.join(tokens)
+        self.offsets = []
+        offset = 0
+        for token in tokens:
+            self.offsets.append(offset)
+            offset += len(token) + 1
+        self.offsets.append(offset)
+
+    def __str__(self):
+        string = "<Sentence %s '%s'>" % (self.section, self.text)
+        return string.encode("UTF-8")
+
+    def __getitem__(self, i):
+        return (self.section, self.tokens)[i]
+
+    def __len__(self):
+        return 2
+
+    def span(self, i, j):
+        """Return the tokens from i up to j as a string, this gives the same
+        result as ' '.join(tokens[i:j])."""
+        i = min(i, self.length)
+        j = min(j, self.length)
+        if i >= j:
+            return ''
+        return self.text[self.offsets[i]:self.offsets[j] - 1]
+
+    def tag_span(self, i, j):
+        """Return a list with the POS tags of tokens i up to j."""
+        if self.tags is None:
+            return None
+        return [TAGSET.names[tag] for tag in self.tags[i:j]]
+
+
 class Term(object):
 
     """A Term is basically a container for a list of TermInstances. The
@@ -327,6 +663,10 @@ class TermInstance(object):
             % (self.id, self.doc_loc, self.tok1, self.tok2, self.context_token())
         return string.encode("UTF-8")
 
+    def sort_key(self):
+        """Key for sorting instances in document order."""
+        return (self.doc_loc, self.tok1)
+
     def __cmp__(self, other):
         comparison1 = cmp(self.doc_loc, other.doc_loc)
         if comparison1 != 0:
@@ -334,22 +674,37 @@ class TermInstance(object):
         return cmp(self.tok1, other.tok1)
 
     def add_context(self, context):
+        """Add the Sentence that the instance occurs in. For older code, the
+        context can also be a [section, tokens] pair."""
+        if not isinstance(context, Sentence):
+            context = Sentence(context[0], context[1])
         self.context = context
 
     def context_section(self):
-        return self.context[0]
+        return self.context.section
 
     def context_all(self):
         return "%s [%s] %s" % (self.context_left(), self.context_token(), self.context_right())
 
     def context_token(self):
-        return ' '.join(self.context[1][self.tok1:self.tok2])
+        return self.context.span(self.tok1, self.tok2)
 
     def context_left(self):
-        return ' '.join(self.context[1][:self.tok1])
+        return self.context.span(0, self.tok1)
 
     def context_right(self):
-        return ' '.join(self.context[1][self.tok2:])
+        return self.context.span(self.tok2, self.context.length)
+
+    def context_tags(self):
+        """Return a list with the POS tags of the term, or None if the tags
+        were not kept."""
+        return self.context.tag_span(self.tok1, self.tok2)
+
+    def context_left_tags(self):
+        return self.context.tag_span(0, self.tok1)
+
+    def context_right_tags(self):
+        return self.context.tag_span(self.tok2, self.context.length)
 
     def check_feature(self, feat, val):
         return self.feats.get(feat) == val
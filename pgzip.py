@@ -0,0 +1,123 @@
+"""
+
+Parallel gzip compression.
+
+The ParallelGzipWriter splits the data written to it into blocks and
+compresses the blocks in a number of threads. Each block is written as a
+separate gzip member, so the output is a standard multi-member gzip file that
+can be read with gunzip, with the gzip module and with open_input_file(). Since
+zlib releases the interpreter lock while compressing, the threads can use
+multiple cores.
+
+   writer = ParallelGzipWriter('features.mallet.gz', threads=8)
+   for line in lines:
+       writer.write(line)
+   writer.close()
+
+The writer can also be created with open_output_file(fname, threads=8), which
+returns a utf-8 StreamWriter on it. At most max_pending blocks are waiting to
+be compressed or written at any time, which bounds memory use to about
+max_pending times the block size.
+
+"""
+
+import zlib, threading
+from collections import deque
+from Queue import Queue
+
+
+class _Block(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.compressed = None
+        self.done = threading.Event()
+
+
+class ParallelGzipWriter(object):
+
+    """File-like object that writes byte strings to a multi-member gzip file,
+    compressing blocks of block_size bytes in parallel threads."""
+
+    def __init__(self, filename, level=6, block_size=1024 * 1024, threads=4,
+                 max_pending=None):
+        self.name = filename
+        self.fh = open(filename, 'wb')
+        self.level = level
+        self.block_size = block_size
+        self.max_pending = max_pending or 2 * threads
+        self.closed = False
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._tasks = Queue()
+        self._workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, data):
+        """Buffer data, submitting a block whenever block_size bytes are
+        buffered. Large strings are cut into pieces so that they are spread
+        over several blocks."""
+        start = 0
+        while start < len(data):
+            piece = data[start:start + self.block_size - self._buffered]
+            start += len(piece)
+            self._buffer.append(piece)
+            self._buffered += len(piece)
+            if self._buffered >= self.block_size:
+                self._submit()
+
+    def flush(self):
+        """Compress and write all buffered data."""
+        self._submit()
+        while self._pending:
+            self._write_oldest()
+        self.fh.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        for worker in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.fh.close()
+        self.closed = True
+
+    def _submit(self):
+        if not self._buffered:
+            return
+        while len(self._pending) >= self.max_pending:
+            self._write_oldest()
+        block = _Block(''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        self._pending.append(block)
+        self._tasks.put(block)
+
+    def _write_oldest(self):
+        block = self._pending.popleft()
+        block.done.wait()
+        self.fh.write(block.compressed)
+
+    def _work(self):
+        while True:
+            block = self._tasks.get()
+            if block is None:
+                break
+            # a window size of 16 + MAX_WBITS gives a gzip header and trailer
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            block.compressed = compressor.compress(block.data) + compressor.flush()
+            block.data = None
+            block.done.set()
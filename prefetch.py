@@ -0,0 +1,123 @@
+"""
+
+Reading dataset files ahead of time.
+
+Processing stages typically loop over the filenames from filename_generator()
+and open each file with open_input_file(). On network storage the processor is
+then idle while a file is fetched. The PrefetchingReader overlaps reading with
+processing by loading upcoming files in background threads:
+
+   filenames = filename_generator(dataset.path, filelist)
+   for filename, text in PrefetchingReader(filenames, ahead=16):
+       process(text)
+
+Files are yielded in the order of the file list. At most ahead files are loaded
+or being loaded at any time, and no new files are requested while the loaded
+files that have not been handed out yet take more than max_bytes. With
+decompress=True, the background threads also decompress and decode the files
+and the reader yields unicode strings. With decompress=False, only the stored
+bytes are fetched and the reader yields a StreamReader, like the one returned
+by open_input_file(), that decompresses while it is read. Files that do not
+exist are yielded with None as their content.
+
+Since gzip decompression and file reading release the interpreter lock, the
+threads give real parallelism for these tasks.
+
+"""
+
+import sys, threading
+from collections import deque
+from Queue import Queue, Empty
+
+from path import read_input_data, open_input_data, decode_input_data
+
+
+class _Slot(object):
+
+    """Placeholder for a file that is loaded by one of the threads."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.content = None
+        self.size = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+class PrefetchingReader(object):
+
+    """Iterator over (filename, content) pairs for filenames, where the
+    content is loaded by a number of background threads. See the module
+    docstring for the meaning of the arguments."""
+
+    def __init__(self, filenames, ahead=8, max_bytes=256 * 1024 * 1024,
+                 decompress=True, threads=4):
+        self.filenames = iter(filenames)
+        self.ahead = ahead
+        self.max_bytes = max_bytes
+        self.decompress = decompress
+        self.threads = threads
+
+    def __iter__(self):
+        tasks = Queue()
+        workers = []
+        for i in range(self.threads):
+            worker = threading.Thread(target=self._work, args=(tasks,))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        pending = deque()
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and self._has_room(pending):
+                    filename = next(self.filenames, None)
+                    if filename is None:
+                        exhausted = True
+                        break
+                    slot = _Slot(filename)
+                    pending.append(slot)
+                    tasks.put(slot)
+                if not pending:
+                    break
+                slot = pending.popleft()
+                slot.done.wait()
+                if slot.error is not None:
+                    raise slot.error[0], slot.error[1], slot.error[2]
+                yield slot.filename, slot.content
+        finally:
+            # drop the files that were not loaded yet and wait for the threads
+            # to finish the files they are working on
+            try:
+                while True:
+                    tasks.get_nowait()
+            except Empty:
+                pass
+            for worker in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+
+    def _has_room(self, pending):
+        if len(pending) >= self.ahead:
+            return False
+        loaded = sum([slot.size for slot in pending if slot.done.is_set()])
+        return loaded < self.max_bytes
+
+    def _work(self, tasks):
+        while True:
+            slot = tasks.get()
+            if slot is None:
+                break
+            try:
+                data, codec = read_input_data(slot.filename)
+                if data is not None:
+                    slot.size = len(data)
+                    if self.decompress:
+                        slot.content = decode_input_data(data, codec)
+                        slot.size = len(slot.content) * 2
+                    else:
+                        slot.content = open_input_data(data, codec)
+            except Exception:
+                slot.error = sys.exc_info()
+            slot.done.set()
@@ -0,0 +1,115 @@
+"""
+
+Progress reporting for batch runs.
+
+A ProgressReporter is created for a dataset when a stage starts and is ticked
+for each file processed. Every interval seconds it writes a small progress
+file to the state directory of the dataset, so that the progress of a long run
+can be followed from outside the process:
+
+   progress = ProgressReporter(dataset, total=len(fspecs))
+   for fspec in fspecs:
+       progress.tick(fspec.target)
+       process(fspec)
+   progress.done()
+
+Each process writes its own file, named progress-HOST-PID.txt, so several
+workers on the same dataset do not overwrite each other. The file has one
+key=value pair per line with the stage, host, process identifier, status
+(running or finished), number of files done and total, rate in files per
+second, estimated seconds left, start and update times and the current file.
+
+Use show_progress() in batch.py to print the progress of all stages of a
+corpus.
+
+"""
+
+import os, time, socket, glob
+
+
+class ProgressReporter(object):
+
+    def __init__(self, dataset, total, interval=10.0):
+        self.dataset = dataset
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.current = None
+        self.started = time.time()
+        self.last_written = 0
+        self.filename = os.path.join(
+            dataset.path, 'state',
+            "progress-%s-%d.txt" % (socket.gethostname(), os.getpid()))
+        self._write('running')
+
+    def __str__(self):
+        return "<ProgressReporter %d/%d>" % (self.count, self.total)
+
+    def tick(self, current=None, n=1):
+        """Add n to the count of files done and write the progress file if the
+        interval has passed."""
+        self.count += n
+        self.current = current
+        now = time.time()
+        if now - self.last_written >= self.interval:
+            self._write('running', now)
+
+    def done(self):
+        self._write('finished')
+
+    def _write(self, status, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = now - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.count) / rate if rate > 0 else -1
+        fields = (('stage', self.dataset.stage_name),
+                  ('host', socket.gethostname()),
+                  ('pid', os.getpid()),
+                  ('status', status),
+                  ('done', self.count),
+                  ('total', self.total),
+                  ('rate', "%.3f" % rate),
+                  ('eta', "%d" % eta),
+                  ('interval', self.interval),
+                  ('started', "%.0f" % self.started),
+                  ('updated', "%.0f" % now),
+                  ('current', self.current))
+        tmp_file = self.filename + '.tmp'
+        fh = open(tmp_file, 'w')
+        for key, val in fields:
+            fh.write("%s=%s\n" % (key, val))
+        fh.close()
+        os.rename(tmp_file, self.filename)
+        self.last_written = now
+
+
+def read_progress_files(state_dir):
+    """Return a list of dictionaries, one for each progress file in state_dir."""
+    progress = []
+    for fname in sorted(glob.glob(os.path.join(state_dir, 'progress-*.txt'))):
+        fields = {}
+        for line in open(fname):
+            if '=' in line:
+                key, val = line.rstrip("\n").split('=', 1)
+                fields[key] = val
+        progress.append(fields)
+    return progress
+
+def format_progress(fields, now=None):
+    """Return a one-line summary of the fields from a progress file. A running
+    process that did not write its file for a while is marked as stalled."""
+    if now is None:
+        now = time.time()
+    status = fields.get('status')
+    updated = float(fields.get('updated', 0))
+    if status == 'running' and now - updated > 3 * float(fields.get('interval', 10)) + 60:
+        status = 'stalled'
+    done = int(fields.get('done', 0))
+    total = int(fields.get('total', 0))
+    percentage = 100.0 * done / total if total else 0.0
+    eta = int(fields.get('eta', -1))
+    eta_string = '-' if eta < 0 or status != 'running' else "%dm%02ds" % (eta // 60, eta % 60)
+    return "%s\t%s\t%d/%d (%.1f%%)\t%s files/sec\tETA %s\t%s:%s\t%s" \
+        % (fields.get('stage'), status, done, total, percentage, fields.get('rate'),
+           eta_string, fields.get('host'), fields.get('pid'), fields.get('current'))
@@ -0,0 +1,216 @@
+"""
+
+Random samples of documents and term instances.
+
+Samples are taken in one pass over a file list, keeping only the sample in
+memory. Each item gets a random key and a reservoir keeps the items with the
+highest keys, which gives a uniform sample of a stream of unknown length.
+Samples can be stratified by year, in which case there is a reservoir of the
+given size for each year:
+
+   docs = sample_documents(dataset, filelist, 100, seed=42)
+   docs_by_year = sample_documents(dataset, filelist, 10, seed=42, by_year=True)
+   instances = sample_term_instances(tag_dataset, feat_dataset, filelist, 200,
+                                     features={'section_loc': 'FH_ABSTRACT:'},
+                                     seed=42, processes=8)
+
+With processes > 1, shards of the file list are sampled in a pool of processes
+and the reservoirs of the shards are merged by keeping the items with the
+highest keys. The random generator for the keys is seeded for each file from
+the seed and the path of the file, so with the same seed the sample is the
+same no matter how many processes are used. Without a seed, a random seed is
+used.
+
+For term instances, the phr_feats file is read first and the tag file is only
+read if one of its instances made it into the sample, since only those need a
+context. Once the reservoir is full this is the case for a shrinking fraction
+of the documents.
+
+"""
+
+import os, sys, heapq, random
+from hashlib import md5
+from itertools import izip
+from multiprocessing import Pool
+
+from path import filename_generator, open_input_file, read_tag_file
+from path import get_year, parse_feats_line, TermInstance
+from misc import shards
+
+
+class Reservoir(object):
+
+    """Keeps the size items with the highest keys that were added to it. The
+    items are stored in a heap of (key, item) pairs."""
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+
+    def __str__(self):
+        return "<Reservoir %d/%d>" % (len(self.heap), self.size)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def accepts(self, key):
+        """Return True if an item with key would be added to the reservoir."""
+        return len(self.heap) < self.size or key > self.heap[0][0]
+
+    def add(self, key, item):
+        """Add item with key, returns the item that was dropped, if any. The
+        returned value is the item that was added if it was not kept."""
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (key, item))
+            return None
+        if key > self.heap[0][0]:
+            return heapq.heapreplace(self.heap, (key, item))[1]
+        return item
+
+    def merge(self, other):
+        for key, item in other.heap:
+            self.add(key, item)
+
+    def items(self):
+        """Return the items, ordered on their keys, highest key first."""
+        return [item for (key, item) in sorted(self.heap, reverse=True)]
+
+
+class StratifiedReservoir(object):
+
+    """A dictionary of Reservoirs indexed on a stratum. If by_year is False,
+    all items go in the same stratum, which has None as its name."""
+
+    def __init__(self, size, by_year=False):
+        self.size = size
+        self.by_year = by_year
+        self.strata = {}
+
+    def __str__(self):
+        return "<StratifiedReservoir size=%d strata=%d>" % (self.size, len(self.strata))
+
+    def reservoir(self, year):
+        stratum = year if self.by_year else None
+        if stratum not in self.strata:
+            self.strata[stratum] = Reservoir(self.size)
+        return self.strata[stratum]
+
+    def merge(self, other):
+        for stratum, reservoir in other.strata.items():
+            if stratum not in self.strata:
+                self.strata[stratum] = Reservoir(self.size)
+            self.strata[stratum].merge(reservoir)
+
+    def result(self):
+        """Return the list of sampled items, or a dictionary of those lists
+        indexed on year if the sample is stratified."""
+        if not self.by_year:
+            return self.reservoir(None).items()
+        return dict((year, reservoir.items()) for year, reservoir in self.strata.items())
+
+
+def file_random(seed, filename):
+    """Return a random generator for filename. The generator only depends on
+    the seed and on the part of the path that is relative to the dataset, so
+    it is the same for each process and for the tag and feats files."""
+    target = filename.split(os.sep + 'files' + os.sep)[-1]
+    digest = md5("%s\t%s" % (seed, target)).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def sample_documents(dataset, filelist, size, seed=None, by_year=False,
+                     processes=1, shard_size=500):
+    """Return a sample of size file paths from the files in filelist in the
+    dataset, or a dictionary of samples for each year if by_year is True."""
+    filenames = filename_generator(dataset.path, filelist)
+    return sample_files(filenames, size, seed, by_year, processes, shard_size)
+
+def sample_files(filenames, size, seed=None, by_year=False, processes=1, shard_size=500):
+    """Return a sample of size paths from filenames, see sample_documents()."""
+    if seed is None:
+        seed = random.random()
+    tasks = ((shard, size, seed, by_year, None, None)
+             for shard in shards(((f,) for f in filenames), shard_size))
+    return _sample(_sample_documents, tasks, processes, size, by_year)
+
+def sample_term_instances(tag_dataset, feat_dataset, filelist, size, terms=None,
+                          features=None, seed=None, by_year=False,
+                          processes=1, shard_size=500):
+    """Return a sample of size TermInstances from the documents in filelist,
+    using the tag and phr_feats files from two DataSets. If terms is given,
+    only instances of those terms are sampled. If features is given, it is a
+    dictionary of feature values that all sampled instances have. Returns a
+    list, or a dictionary of lists for each year if by_year is True."""
+    tag_files = filename_generator(tag_dataset.path, filelist)
+    feat_files = filename_generator(feat_dataset.path, filelist)
+    file_shards = shards(izip(tag_files, feat_files), shard_size)
+    if seed is None:
+        seed = random.random()
+    if terms is not None:
+        terms = set(terms)
+    tasks = ((shard, size, seed, by_year, terms, features) for shard in file_shards)
+    return _sample(_sample_term_instances, tasks, processes, size, by_year)
+
+def _sample(function, tasks, processes, size, by_year):
+    sample = StratifiedReservoir(size, by_year)
+    if processes < 2:
+        for task in tasks:
+            sample.merge(function(task))
+    else:
+        pool = Pool(processes)
+        for shard_sample in pool.imap_unordered(function, tasks):
+            sample.merge(shard_sample)
+        pool.close()
+        pool.join()
+    return sample.result()
+
+def _sample_documents(task):
+    (shard, size, seed, by_year, terms, features) = task
+    sample = StratifiedReservoir(size, by_year)
+    for (filename,) in shard:
+        key = file_random(seed, filename).random()
+        sample.reservoir(get_year(filename)).add(key, filename)
+    return sample
+
+def _sample_term_instances(task):
+    (shard, size, seed, by_year, terms, features) = task
+    sample = StratifiedReservoir(size, by_year)
+    for tag_file, feat_file in shard:
+        fh = open_input_file(feat_file)
+        if fh is None:
+            continue
+        rng = file_random(seed, feat_file)
+        added = []
+        for line in fh:
+            (id, year, term, feats) = parse_feats_line(line)
+            if terms is not None and term not in terms:
+                continue
+            if features is not None and \
+                    [f for f in features if feats.get(f) != features[f]]:
+                continue
+            key = rng.random()
+            reservoir = sample.reservoir(year)
+            if reservoir.accepts(key):
+                instance = TermInstance(term, [id, year, feats])
+                reservoir.add(key, instance)
+                added.append(instance)
+        fh.close()
+        if added:
+            # instances that were pushed out again by later instances of the
+            # same file also get a context, which is cheaper than checking
+            sentences = read_tag_file(tag_file, keep_tags=False)[0]
+            for instance in added:
+                instance.add_context(sentences[instance.doc_loc])
+    return sample
+
+
+
+if __name__ == '__main__':
+
+    # usage: python sampling.py DATASET_PATH FILELIST SIZE [SEED]
+    # prints a sample of the documents in the dataset
+    dataset_path, filelist, size = sys.argv[1:4]
+    seed = sys.argv[4] if len(sys.argv) > 4 else None
+    filenames = filename_generator(dataset_path, filelist)
+    for filename in sample_files(filenames, int(size), seed):
+        print filename
@@ -0,0 +1,187 @@
+"""
+
+Size-aware batch scheduling.
+
+Cutting a file list into batches with the same number of files gives batches
+that take very different amounts of time, since documents vary in size by
+orders of magnitude. The BatchScheduler uses the sizes of the input files to
+create batches with about the same total size:
+
+   scheduler = BatchScheduler(dataset, filelist, input_dataset, batch_size=500)
+   for fspecs in scheduler.plan():
+       process(fspecs)
+
+The number of batches is the same as with batches of batch_size files. Files
+are assigned to batches largest first, each file going to the batch with the
+smallest total so far, and the batches are handed out largest first, so the
+batches that take longest start first and the small ones fill the gaps at the
+end. Within a batch, files are in the order of the file list. The plan is a
+list of lists of FileSpecs, which is what get_lines() returns for one batch.
+
+Sizes are taken from the input dataset, or from the sources in the file list
+for the first stage of a pipeline. For compressed files and for data stored
+compressed in packed storage the compressed size is multiplied with
+COMPRESSION_RATIO, so that they can be compared with uncompressed files. Sizes
+are cached in state/sizes.txt of the dataset, with the target and the size on
+each line, so the file system only has to be checked once.
+
+The plan can also be used with a WorkQueue, by writing the file list in plan
+order and giving the line ranges of the batches to the queue:
+
+   ranges = scheduler.write_filelist(dataset.path + '/state/files-planned.txt')
+   queue = WorkQueue(dataset, dataset.path + '/state/files-planned.txt')
+   queue.initialize(ranges)
+
+"""
+
+import os, sys, heapq
+
+from path import FileSpec
+from packed import lookup
+from compression import CODECS
+
+
+# rough ratio between uncompressed and compressed sizes for tag and feature
+# files, this is about right for gzip, other codecs are treated the same
+COMPRESSION_RATIO = 4
+
+
+def file_size(filename):
+    """Return the estimated uncompressed size of filename, looking in packed
+    storage, at the file and at the file with the extension of a compression
+    codec. Returns 0 if the file does not exist."""
+    store, target = lookup(filename)
+    if store is not None and store.has(target):
+        size = store.size(target)
+        return size if store.codec(target) == 'raw' else size * COMPRESSION_RATIO
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        pass
+    for codec in CODECS:
+        try:
+            return os.stat(filename + codec.extension).st_size * COMPRESSION_RATIO
+        except OSError:
+            pass
+    return 0
+
+
+class Batch(object):
+
+    def __init__(self):
+        self.size = 0
+        self.lines = []
+
+    def __str__(self):
+        return "<Batch files=%d size=%d>" % (len(self.lines), self.size)
+
+    def fspecs(self):
+        return [fspec for (line_number, fspec) in sorted(self.lines)]
+
+    def line_numbers(self):
+        return sorted([line_number for (line_number, fspec) in self.lines])
+
+
+class BatchScheduler(object):
+
+    """Creates size-balanced batches from the lines of filelist, see the
+    module docstring. The dataset is the dataset that is created, its state
+    directory holds the size cache. The input_dataset is None for the first
+    stage, in which case sizes are taken from the sources in the file list."""
+
+    def __init__(self, dataset, filelist, input_dataset=None, batch_size=500):
+        self.dataset = dataset
+        self.filelist = filelist
+        self.input_dataset = input_dataset
+        self.batch_size = batch_size
+        self.cache_file = os.path.join(dataset.path, 'state', 'sizes.txt')
+        self.lines = None
+        self.sizes = None
+        self.batches = None
+
+    def __str__(self):
+        return "<BatchScheduler %s batch_size=%d>" % (self.filelist, self.batch_size)
+
+    def read_fspecs(self):
+        """Return the FileSpecs from the file list, up to the first empty line
+        like get_lines(). The lines themselves are kept in self.lines."""
+        self.lines = []
+        for line in open(self.filelist):
+            if line.strip() == '':
+                break
+            self.lines.append(line.rstrip("\n"))
+        return [FileSpec(line) for line in self.lines]
+
+    def input_file(self, fspec):
+        if self.input_dataset is None:
+            return fspec.source if fspec.source is not None else fspec.target
+        return os.path.join(self.input_dataset.path, 'files', fspec.target)
+
+    def load_sizes(self):
+        self.sizes = {}
+        if os.path.exists(self.cache_file):
+            for line in open(self.cache_file):
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 2:
+                    self.sizes[fields[0]] = int(fields[1])
+        return self.sizes
+
+    def get_sizes(self, fspecs):
+        """Return a dictionary with the sizes of the files of fspecs, indexed on
+        the targets. Sizes that are not in the cache are added to it."""
+        if self.sizes is None:
+            self.load_sizes()
+        new_sizes = []
+        for fspec in fspecs:
+            if fspec.target not in self.sizes:
+                size = file_size(self.input_file(fspec))
+                self.sizes[fspec.target] = size
+                new_sizes.append((fspec.target, size))
+        if new_sizes:
+            fh = open(self.cache_file, 'a')
+            for target, size in new_sizes:
+                fh.write("%s\t%d\n" % (target, size))
+            fh.close()
+        return self.sizes
+
+    def create_batches(self):
+        """Create the batches and return them, largest batch first."""
+        fspecs = self.read_fspecs()
+        sizes = self.get_sizes(fspecs)
+        number_of_batches = (len(fspecs) + self.batch_size - 1) // self.batch_size
+        batches = [Batch() for i in range(number_of_batches)]
+        heap = [(0, i) for i in range(number_of_batches)]
+        lines = sorted(enumerate(fspecs), key=lambda x: sizes[x[1].target], reverse=True)
+        for line_number, fspec in lines:
+            size, i = heapq.heappop(heap)
+            batches[i].lines.append((line_number, fspec))
+            batches[i].size += sizes[fspec.target]
+            heapq.heappush(heap, (batches[i].size, i))
+        self.batches = sorted(batches, key=lambda b: b.size, reverse=True)
+        return self.batches
+
+    def plan(self):
+        """Return the batches as a list of lists of FileSpecs."""
+        if self.batches is None:
+            self.create_batches()
+        return [batch.fspecs() for batch in self.batches]
+
+    def write_filelist(self, filename):
+        """Write the lines of the file list in the order of the plan to filename
+        and return a list of (start, end) line ranges for the batches."""
+        if self.batches is None:
+            self.create_batches()
+        ranges = []
+        fh = open(filename, 'w')
+        start = 0
+        for batch in self.batches:
+            for line_number in batch.line_numbers():
+                fh.write(self.lines[line_number] + "\n")
+            ranges.append((start, start + len(batch.lines)))
+            start += len(batch.lines)
+        fh.close()
+        return ranges
+
+    def print_plan(self):
+        for batch in self.batches or self.create_batches():
+            print batch
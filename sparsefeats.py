@@ -0,0 +1,162 @@
+"""
+
+Compact sparse feature vectors.
+
+The document features from generate_doc_feats() in batch.py are lists with the
+term, the uid and the feature strings, which end up in mallet files where the
+same long name=value strings are repeated millions of times. The
+SparseFeatureWriter replaces the feature strings with integer identifiers and
+writes one sparse vector for each term:
+
+   writer = SparseFeatureWriter('features.vec', vocabulary_file='features.voc')
+   for doc_feats in ...:
+       writer.write_doc_feats(doc_feats)
+   writer.close()
+   for term, uid, feature_ids in read_sparse_vectors('features.vec'):
+       ...
+
+Feature identifiers come from a featcache.Vocabulary, which is loaded from
+vocabulary_file if it exists and saved to it when the writer is closed, so
+training and test data can share one vocabulary. With grow=False, features
+that are not in the vocabulary are dropped, which is what is needed for test
+data. For vocabularies that are too large to keep in memory, give hash_bits
+instead, identifiers are then the crc32 of the feature modulo 2**hash_bits and
+no vocabulary is kept.
+
+There are two output formats. In the text format, each line has the term, the
+uid and the space-separated feature identifiers, separated by tabs. The binary
+format starts with the line SPFV1 and has for each vector the lengths of the
+utf-8 encoded term and uid and the number of features as little-endian 16, 16
+and 32 bit integers, followed by the term, the uid and the features as 32 bit
+integers. Both formats are written with open_output_file(), so they are
+gzipped by default and work with packed storage.
+
+"""
+
+import os, sys, struct, zlib
+from array import array
+
+from path import open_output_file, read_input_data, open_input_data
+from featcache import Vocabulary
+
+
+BINARY_MAGIC = 'SPFV1\n'
+RECORD_HEADER = struct.Struct('<HHI')
+
+
+class SparseFeatureWriter(object):
+
+    """Writes sparse vectors to filename, see the module docstring. The
+    vocabulary can be given as a Vocabulary instance or as a file."""
+
+    def __init__(self, filename, vocabulary=None, vocabulary_file=None,
+                 hash_bits=None, binary=False, grow=True, compress=True):
+        self.filename = filename
+        self.vocabulary_file = vocabulary_file
+        self.hash_bits = hash_bits
+        self.binary = binary
+        self.grow = grow
+        self.vectors = 0
+        self.vocabulary = vocabulary
+        if hash_bits is None and vocabulary is None:
+            if vocabulary_file is not None and os.path.exists(vocabulary_file):
+                self.vocabulary = Vocabulary.load(vocabulary_file)
+            else:
+                self.vocabulary = Vocabulary()
+        self.fh = open_output_file(filename, compress=compress)
+        if binary:
+            # binary data go to the stream under the utf-8 writer
+            self.stream = self.fh.stream
+            self.stream.write(BINARY_MAGIC)
+
+    def __str__(self):
+        features = "hash_bits=%d" % self.hash_bits if self.hash_bits is not None \
+                   else "features=%d" % len(self.vocabulary)
+        return "<SparseFeatureWriter %s vectors=%d %s>" % (self.filename, self.vectors, features)
+
+    def feature_ids(self, features):
+        """Return a sorted array of identifiers for the feature strings."""
+        ids = array('I')
+        if self.hash_bits is not None:
+            mask = (1 << self.hash_bits) - 1
+            for feature in set(features):
+                if isinstance(feature, unicode):
+                    feature = feature.encode('utf-8')
+                ids.append(zlib.crc32(feature) & mask)
+        else:
+            for feature in features:
+                id = self.vocabulary.get_id(feature, self.grow)
+                if id is not None:
+                    ids.append(id)
+        return array('I', sorted(set(ids)))
+
+    def write(self, term, uid, features):
+        ids = self.feature_ids(features)
+        if self.binary:
+            term = term.encode('utf-8') if isinstance(term, unicode) else term
+            uid = uid.encode('utf-8') if isinstance(uid, unicode) else uid
+            if sys.byteorder != 'little':
+                ids.byteswap()
+            self.stream.write(RECORD_HEADER.pack(len(term), len(uid), len(ids)))
+            self.stream.write(term)
+            self.stream.write(uid)
+            self.stream.write(ids.tostring())
+        else:
+            self.fh.write(u"%s\t%s\t%s\n" % (term, uid, u' '.join(map(unicode, ids))))
+        self.vectors += 1
+
+    def write_doc_feats(self, d_doc_feats):
+        """Write the vectors for a dictionary as returned by generate_doc_feats(),
+        where the values are lists with the term, the uid and the features."""
+        for key in sorted(d_doc_feats):
+            features = d_doc_feats[key]
+            self.write(features[0], features[1], features[2:])
+
+    def close(self):
+        self.fh.close()
+        if self.vocabulary_file is not None and self.hash_bits is None:
+            self.vocabulary.save(self.vocabulary_file)
+
+
+def read_sparse_vectors(filename):
+    """Generate (term, uid, feature_ids) triples from a file written by a
+    SparseFeatureWriter, in either format. The terms and uids are unicode
+    strings and the feature identifiers are in an array."""
+    data, codec = read_input_data(filename)
+    if data is None:
+        return
+    stream = open_input_data(data, codec).stream
+    if stream.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+        data = stream.read()
+        offset = 0
+        while offset < len(data):
+            (term_length, uid_length, n) = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            term = data[offset:offset + term_length].decode('utf-8')
+            offset += term_length
+            uid = data[offset:offset + uid_length].decode('utf-8')
+            offset += uid_length
+            ids = array('I', data[offset:offset + 4 * n])
+            if sys.byteorder != 'little':
+                ids.byteswap()
+            offset += 4 * n
+            yield term, uid, ids
+    else:
+        stream.seek(0)
+        # split on newlines only, terms can contain characters like u'\x85'
+        # that the StreamReader would also split on
+        for line in stream.read().decode('utf-8').split(u"\n"):
+            if line:
+                term, uid, ids = line.split(u"\t")
+                yield term, uid, array('I', [int(id) for id in ids.split()])
+
+
+
+if __name__ == '__main__':
+
+    # usage: python sparsefeats.py VECTOR_FILE [VOCABULARY_FILE]
+    # prints the vectors, with feature strings if a vocabulary is given
+    vocabulary = Vocabulary.load(sys.argv[2]) if len(sys.argv) > 2 else None
+    for term, uid, ids in read_sparse_vectors(sys.argv[1]):
+        features = ids if vocabulary is None else [vocabulary[id] for id in ids]
+        print ("%s\t%s\t%s" % (term, uid, ' '.join(map(unicode, features)))).encode('utf-8')
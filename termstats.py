@@ -0,0 +1,225 @@
+"""
+
+Corpus-wide term statistics.
+
+Collects, for a phr_feats dataset, the document frequency and the number of
+instances of each term, and the number of instances per term and year and per
+term and section. The dataset is divided into shards of files that are
+processed in a pool of processes, the statistics of the shards are merged when
+they come in:
+
+   stats = collect_statistics(dataset, filelist, processes=8)
+   stats.save('stats/ln-us-all')
+   stats = TermStatistics.load('stats/ln-us-all')
+   print stats.get_doc_freq('computer program')
+   print stats.get_term_year('computer program', '2000')
+
+The year of a document is taken from its path with get_year_and_docid() and
+the section from the section_loc feature.
+
+Terms, years and sections are interned to integer identifiers, in the order
+in which they are first seen. Document frequencies and instance counts are
+arrays indexed on term identifiers, and the counts per term and year or
+section are Counters indexed on a single integer that combines the two
+identifiers. The tables of a shard are small to pickle and merging them only
+has to map the identifiers of the shard to those of the merged statistics.
+
+Statistics are saved in a directory with a file meta.txt with the number of
+documents and three gzipped tab-separated files:
+
+   terms.tab.gz          term, document frequency, instances
+   term_year.tab.gz      term, year, instances
+   term_section.tab.gz   term, section, instances
+
+Statistics that were saved can be loaded and merged with other statistics, so
+new parts of a corpus can be added without processing everything again.
+
+"""
+
+import os, sys
+from array import array
+from collections import Counter
+from multiprocessing import Pool
+
+from path import open_input_file, open_output_file, filename_generator
+from path import get_year_and_docid, parse_feats_line, ensure_path
+from misc import shards
+from featcache import Vocabulary
+
+
+# the counts per term and year or section are indexed on the term identifier
+# shifted by KEY_BITS, or-ed with the identifier of the year or section
+KEY_BITS = 20
+KEY_MASK = (1 << KEY_BITS) - 1
+
+
+class TermStatistics(object):
+
+    """Count tables for terms, see the module docstring. The doc_freq and
+    instances arrays are indexed on term identifiers, term_year and
+    term_section are Counters indexed on keys created with key()."""
+
+    def __init__(self):
+        self.documents = 0
+        self.terms = Vocabulary()
+        self.years = Vocabulary()
+        self.sections = Vocabulary()
+        self.doc_freq = array('l')
+        self.instances = array('l')
+        self.term_year = Counter()
+        self.term_section = Counter()
+
+    def __str__(self):
+        return "<TermStatistics documents=%d terms=%d instances=%d>" \
+            % (self.documents, len(self.terms), sum(self.instances))
+
+    def term_id(self, term):
+        """Return the identifier of term, adding it to the tables if it is new."""
+        id = self.terms.get_id(term)
+        if id == len(self.doc_freq):
+            self.doc_freq.append(0)
+            self.instances.append(0)
+        return id
+
+    def key(self, term_id, other_id):
+        if other_id > KEY_MASK:
+            raise ValueError("too many years or sections")
+        return (term_id << KEY_BITS) | other_id
+
+    def get_doc_freq(self, term):
+        id = self.terms.get_id(term, False)
+        return 0 if id is None else self.doc_freq[id]
+
+    def get_instances(self, term):
+        id = self.terms.get_id(term, False)
+        return 0 if id is None else self.instances[id]
+
+    def get_term_year(self, term, year):
+        return self._get_count(self.term_year, term, self.years, year)
+
+    def get_term_section(self, term, section):
+        return self._get_count(self.term_section, term, self.sections, section)
+
+    def _get_count(self, table, term, vocabulary, string):
+        term_id = self.terms.get_id(term, False)
+        other_id = vocabulary.get_id(string, False)
+        if term_id is None or other_id is None:
+            return 0
+        return table[self.key(term_id, other_id)]
+
+    def add_file(self, feat_file):
+        """Add the counts for a phr_feats file."""
+        fh = open_input_file(feat_file)
+        if fh is None:
+            return
+        year_id = self.years.get_id(get_year_and_docid(feat_file)[0])
+        term_ids = set()
+        for line in fh:
+            (id, _year, term, feats) = parse_feats_line(line)
+            term_id = self.term_id(term)
+            term_ids.add(term_id)
+            self.instances[term_id] += 1
+            self.term_year[self.key(term_id, year_id)] += 1
+            section_id = self.sections.get_id(feats.get('section_loc', ''))
+            self.term_section[self.key(term_id, section_id)] += 1
+        fh.close()
+        for term_id in term_ids:
+            self.doc_freq[term_id] += 1
+        self.documents += 1
+
+    def merge(self, other):
+        """Add the counts from another TermStatistics instance, mapping the
+        identifiers of other to those of this instance."""
+        self.documents += other.documents
+        term_ids = [self.term_id(term) for term in other.terms.strings]
+        for other_id, term_id in enumerate(term_ids):
+            self.doc_freq[term_id] += other.doc_freq[other_id]
+            self.instances[term_id] += other.instances[other_id]
+        for table, other_table, vocabulary, other_vocabulary in \
+                ((self.term_year, other.term_year, self.years, other.years),
+                 (self.term_section, other.term_section, self.sections, other.sections)):
+            ids = [vocabulary.get_id(string) for string in other_vocabulary.strings]
+            for key, count in other_table.iteritems():
+                table[self.key(term_ids[key >> KEY_BITS], ids[key & KEY_MASK])] += count
+
+    def save(self, directory):
+        ensure_path(directory)
+        fh = open(os.path.join(directory, 'meta.txt'), 'w')
+        fh.write("documents=%d\n" % self.documents)
+        fh.close()
+        fh = open_output_file(os.path.join(directory, 'terms.tab'))
+        for term in sorted(self.terms.strings):
+            id = self.terms.get_id(term)
+            fh.write(u"%s\t%d\t%d\n" % (term, self.doc_freq[id], self.instances[id]))
+        fh.close()
+        for name, table, vocabulary in (('term_year', self.term_year, self.years),
+                                        ('term_section', self.term_section, self.sections)):
+            fh = open_output_file(os.path.join(directory, name + '.tab'))
+            rows = [(self.terms[key >> KEY_BITS], vocabulary[key & KEY_MASK], count)
+                    for key, count in table.iteritems()]
+            for row in sorted(rows):
+                fh.write(u"%s\t%s\t%d\n" % row)
+            fh.close()
+
+    @classmethod
+    def load(cls, directory):
+        stats = cls()
+        for line in open(os.path.join(directory, 'meta.txt')):
+            if line.startswith('documents='):
+                stats.documents = int(line.strip().split('=')[1])
+        for line in open_input_file(os.path.join(directory, 'terms.tab')):
+            term, doc_freq, instances = line.rstrip(u"\n").split(u"\t")
+            id = stats.term_id(term)
+            stats.doc_freq[id] = int(doc_freq)
+            stats.instances[id] = int(instances)
+        for name, table, vocabulary in (('term_year', stats.term_year, stats.years),
+                                        ('term_section', stats.term_section, stats.sections)):
+            for line in open_input_file(os.path.join(directory, name + '.tab')):
+                term, string, count = line.rstrip(u"\n").split(u"\t")
+                key = stats.key(stats.term_id(term), vocabulary.get_id(string))
+                table[key] = int(count)
+        return stats
+
+
+def _process_shard(filenames):
+    stats = TermStatistics()
+    for filename in filenames:
+        stats.add_file(filename)
+    return stats
+
+def collect_statistics(dataset, filelist, processes=4, shard_size=500, verbose=False):
+    """Return the TermStatistics for all files in filelist from a phr_feats
+    dataset."""
+    filenames = filename_generator(dataset.path, filelist)
+    return collect_file_statistics(filenames, processes, shard_size, verbose)
+
+def collect_file_statistics(filenames, processes=4, shard_size=500, verbose=False):
+    """Return the TermStatistics for phr_feats files, processing shards of
+    shard_size files in a pool of processes."""
+    file_shards = shards(filenames, shard_size)
+    stats = TermStatistics()
+    if processes < 2:
+        results = (_process_shard(shard) for shard in file_shards)
+    else:
+        pool = Pool(processes)
+        results = pool.imap_unordered(_process_shard, file_shards)
+    for shard_stats in results:
+        stats.merge(shard_stats)
+        if verbose:
+            print "[collect_statistics] %d documents" % stats.documents
+    if processes >= 2:
+        pool.close()
+        pool.join()
+    return stats
+
+
+
+if __name__ == '__main__':
+
+    # usage: python termstats.py DATASET_PATH FILELIST OUTPUT_DIRECTORY [PROCESSES]
+    dataset_path, filelist, directory = sys.argv[1:4]
+    processes = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    filenames = filename_generator(dataset_path, filelist)
+    stats = collect_file_statistics(filenames, processes, verbose=True)
+    stats.save(directory)
+    print stats
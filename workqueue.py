@@ -0,0 +1,251 @@
+"""
+
+Work queue for processing a dataset with several processes or machines.
+
+The queue divides the lines of a file list into batches and keeps track of the
+batches in the state directory of a dataset. Workers claim a batch, which gives
+them a lease that is valid for lease_time seconds. Workers should renew the
+lease with heartbeat() while they are working on a batch and call complete()
+when they are done, or release() if they give up on the batch. Leases that were
+not renewed in time are handed out again to other workers, so batches of
+workers that died are not lost.
+
+Typical use by a worker, which can run on any machine that sees the dataset:
+
+   queue = WorkQueue(dataset, filelist, batch_size=500)
+   queue.initialize()
+   while True:
+       lease = queue.claim()
+       if lease is None:
+           break
+       t1 = time.time()
+       process(lease.fspecs())
+       queue.complete(lease, t1)
+
+Or, with a heartbeat sent from a background thread:
+
+   queue.process(lambda fspecs: process(fspecs))
+
+A ProgressReporter can be handed to process(), it is ticked after each batch.
+
+The queue is stored in state/queue.txt, with one line for each batch containing
+the first line number, the end line number, the status (pending, leased or
+done), the owner of the lease and the expiration time of the lease. All access
+goes through a lock on state/queue.lock, using POSIX locks, which also work on
+most shared file systems, and the queue file is replaced atomically. When a
+batch is completed, the count in state/processed.txt is incremented and a line
+is added to state/processing-history.txt.
+
+Since lease expiration times are compared between machines, their clocks should
+be roughly synchronized and lease_time should be much larger than any expected
+clock difference.
+
+"""
+
+import os, time, socket, fcntl, threading
+
+from path import get_lines
+
+
+class Lease(object):
+
+    """A claim on the lines from start up to end in the file list."""
+
+    def __init__(self, queue, start, end, owner, expires):
+        self.queue = queue
+        self.start = start
+        self.end = end
+        self.owner = owner
+        self.expires = expires
+
+    def __str__(self):
+        return "<Lease %d-%d %s>" % (self.start, self.end, self.owner)
+
+    def size(self):
+        return self.end - self.start
+
+    def fspecs(self):
+        """Return the FileSpecs for the lines in the batch."""
+        return get_lines(self.queue.filelist, self.start, self.size())
+
+
+class WorkQueue(object):
+
+    """Queue of batches from filelist for the dataset, see the module
+    docstring for details. The owner identifies the worker and defaults to the
+    host name and the process identifier."""
+
+    def __init__(self, dataset, filelist, batch_size=500, lease_time=600, owner=None):
+        self.dataset = dataset
+        self.filelist = filelist
+        self.batch_size = batch_size
+        self.lease_time = lease_time
+        self.owner = owner
+        if self.owner is None:
+            self.owner = "%s-%d" % (socket.gethostname(), os.getpid())
+        state_dir = os.path.join(dataset.path, 'state')
+        self.queue_file = os.path.join(state_dir, 'queue.txt')
+        self.lock_file = os.path.join(state_dir, 'queue.lock')
+        # POSIX locks do not exclude threads of the same process
+        self._thread_lock = threading.Lock()
+        self._lock_fh = None
+
+    def __str__(self):
+        return "<WorkQueue %s batch_size=%d>" % (self.queue_file, self.batch_size)
+
+    def _lock(self):
+        self._thread_lock.acquire()
+        self._lock_fh = open(self.lock_file, 'a')
+        fcntl.lockf(self._lock_fh, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.lockf(self._lock_fh, fcntl.LOCK_UN)
+        self._lock_fh.close()
+        self._lock_fh = None
+        self._thread_lock.release()
+
+    def _read(self):
+        batches = []
+        for line in open(self.queue_file):
+            (start, end, status, owner, expires) = line.rstrip("\n").split("\t")
+            batches.append([int(start), int(end), status, owner, float(expires)])
+        return batches
+
+    def _write(self, batches):
+        tmp_file = "%s.%s.tmp" % (self.queue_file, self.owner)
+        fh = open(tmp_file, 'w')
+        for batch in batches:
+            fh.write("%d\t%d\t%s\t%s\t%.2f\n" % tuple(batch))
+        fh.close()
+        os.rename(tmp_file, self.queue_file)
+
+    def initialize(self, ranges=None):
+        """Create the queue if it does not exist yet. The file list is divided
+        into batches of batch_size lines, counting lines like get_lines(), that
+        is, up to the first empty line. Alternatively, ranges is a list of
+        (start, end) pairs of line numbers, for example from a BatchScheduler,
+        which are used as the batches. Returns the number of batches."""
+        self._lock()
+        try:
+            if os.path.exists(self.queue_file):
+                return len(self._read())
+            if ranges is not None:
+                self._write([[start, end, 'pending', '-', 0] for (start, end) in ranges])
+                return len(ranges)
+            lines = 0
+            for line in open(self.filelist):
+                if line.strip() == '':
+                    break
+                lines += 1
+            batches = []
+            for start in range(0, lines, self.batch_size):
+                end = min(lines, start + self.batch_size)
+                batches.append([start, end, 'pending', '-', 0])
+            self._write(batches)
+            return len(batches)
+        finally:
+            self._unlock()
+
+    def claim(self):
+        """Claim the first batch that is pending or has an expired lease and
+        return a Lease, or return None if there are no batches left."""
+        self._lock()
+        try:
+            now = time.time()
+            batches = self._read()
+            for batch in batches:
+                if batch[2] == 'pending' or (batch[2] == 'leased' and batch[4] < now):
+                    batch[2:5] = ['leased', self.owner, now + self.lease_time]
+                    self._write(batches)
+                    return Lease(self, batch[0], batch[1], self.owner, batch[4])
+            return None
+        finally:
+            self._unlock()
+
+    def _update(self, lease, status, expires, time_elapsed=0):
+        """Change the status of the batch of lease if the lease is still held
+        by its owner. Returns True if the batch was changed."""
+        self._lock()
+        try:
+            batches = self._read()
+            for batch in batches:
+                if batch[0] == lease.start and batch[1] == lease.end:
+                    if batch[2] != 'leased' or batch[3] != lease.owner:
+                        return False
+                    batch[2:5] = [status, lease.owner if status != 'pending' else '-', expires]
+                    self._write(batches)
+                    if status == 'done':
+                        self.dataset.update_processed_count(lease.size())
+                        self.dataset.update_history(lease.size(), time_elapsed)
+                    return True
+            return False
+        finally:
+            self._unlock()
+
+    def heartbeat(self, lease):
+        """Renew the lease. Returns False if the lease was lost, in which case
+        another worker may be processing the batch."""
+        expires = time.time() + self.lease_time
+        if self._update(lease, 'leased', expires):
+            lease.expires = expires
+            return True
+        return False
+
+    def release(self, lease):
+        """Give up the lease and make the batch available to other workers."""
+        return self._update(lease, 'pending', 0)
+
+    def complete(self, lease, t1=None):
+        """Mark the batch as done, add its size to the processed count and add
+        a line to the processing history. Here t1 is the time when processing
+        of the batch started. Returns False if the lease was lost."""
+        time_elapsed = 0 if t1 is None else time.time() - t1
+        return self._update(lease, 'done', time.time(), time_elapsed)
+
+    def status(self):
+        """Return a dictionary with the number of batches for each status,
+        counting expired leases as pending."""
+        now = time.time()
+        counts = { 'pending': 0, 'leased': 0, 'done': 0 }
+        for batch in self._read():
+            status = batch[2]
+            if status == 'leased' and batch[4] < now:
+                status = 'pending'
+            counts[status] += 1
+        return counts
+
+    def process(self, function, progress=None):
+        """Claim batches and hand their FileSpecs to function until no batches
+        are left. A background thread renews the lease while function is
+        running. If function raises an exception, the batch is released. If
+        progress is a ProgressReporter, it is ticked with the size of each
+        completed batch and marked as done at the end."""
+        while True:
+            lease = self.claim()
+            if lease is None:
+                break
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(lease, stop))
+            heartbeat.daemon = True
+            heartbeat.start()
+            t1 = time.time()
+            try:
+                function(lease.fspecs())
+            except:
+                stop.set()
+                heartbeat.join()
+                self.release(lease)
+                raise
+            stop.set()
+            heartbeat.join()
+            self.complete(lease, t1)
+            if progress is not None:
+                progress.tick("%s:%d-%d" % (self.filelist, lease.start, lease.end), lease.size())
+        if progress is not None:
+            progress.done()
+
+    def _heartbeat(self, lease, stop):
+        while not stop.wait(self.lease_time / 3.0):
+            if not self.heartbeat(lease):
+                print "[WorkQueue] WARNING: lost lease on %s" % lease
+                break